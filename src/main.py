@@ -8,4 +8,6 @@ load_dotenv(dotenv_path=args.env)
 import asyncio
 from utils.server import start_web_server
 
-asyncio.run(start_web_server())
\ No newline at end of file
+# Guarded so worker processes spawned for operations don't start another server
+if __name__ == "__main__":
+    asyncio.run(start_web_server())
\ No newline at end of file
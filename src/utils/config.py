@@ -3,12 +3,17 @@ import yaml
 from typing import get_type_hints, List, Dict
 from .helpers.singleton import Singleton
 from .helpers.path import portable_path
+from .helpers.codec import AudioCodec
 from .args import args
 
 class UnknownField(Exception):
     def __init__(self, field: str):
         super().__init__("Config field {} does not exist".format(field))
 
+class InvalidField(Exception):
+    def __init__(self, field: str, reason: str):
+        super().__init__("Config field {} is invalid: {}".format(field, reason))
+
 class UnknownFile(Exception):
     def __init__(self, filepath: str):
         super().__init__("Config file {} does not exist".format(filepath))
@@ -31,6 +36,45 @@ class Config(metaclass=Singleton):
     prompter: dict = dict()
     history_filepath: str = portable_path(os.path.join(os.getcwd(), "output", "history.txt")) # debug
 
+    # Jobs
+    job_max_concurrent: int = 4 # Jobs allowed to run at once when they don't use the same resources
+    audio_interrupts_response: bool = False # Conversation audio cancels running and queued responses as soon as it's requested
+    context_batch_max: int = 1 # Queued text context jobs merged into one batch at most (1 disables merging)
+
+    # Response pipeline
+    response_streaming: bool = False # Filter and speak each sentence while T2T is still generating
+    response_stream_tokens: bool = False # Broadcast T2T output piece by piece as it is generated
+    response_stream_min_chars: int = 1 # Shorter sentences are merged into the next one when streaming
+    response_lookahead: int = 2 # How many results a stage may get ahead of the stage after it
+    response_max_queue_age: float = 0 # Seconds a response may wait in the queue before it's dropped, 0 waits forever
+    response_supersede: bool = False # New responses drop older responses still waiting in the queue
+    audio_output_codec: str = "pcm" # Codec audio is broadcast in: pcm, flac or opus (falls back to flac)
+    response_graph: list = list() # Stages after T2T, defaults to text filters -> TTS -> audio filters
+
+    # Operations
+    blocking_executor_workers: int = 4 # Threads shared by operations that block (sync SDKs, local models)
+    openai_warmup: bool = True # Open a connection to each OpenAI endpoint when its first operation starts
+    openai_keepalive_expiry: float = 120.0 # Seconds an idle connection to an OpenAI endpoint is kept open
+
+    # Tracing
+    tracing: bool = True # Record a timeline of each job, saved to traces.jsonl in the log directory
+    trace_max_spans: int = 500 # Spans per job kept for its final event (all are still saved to file)
+    trace_file_max_bytes: int = 10485760 # Size at which traces.jsonl is rotated
+    trace_file_backups: int = 3 # Rotated trace files kept
+
+    # Websocket
+    ws_send_queue_size: int = 256 # Events waiting to be sent to one client before its overflow policy applies
+    ws_text_overflow: str = "drop_oldest" # What to do when a text event doesn't fit: drop_oldest, drop_newest or disconnect
+    ws_audio_overflow: str = "disconnect" # What to do when an audio event doesn't fit: drop_oldest, drop_newest or disconnect
+    ws_batch_window_ms: float = 5 # How long small events wait to be sent together to clients that asked for batches
+    ws_replay_size: int = 512 # Recent events kept for reconnecting clients to catch up on, 0 disables
+
+    # Jobs over HTTP
+    job_result_cache_size: int = 256 # Finished jobs whose result can still be fetched over HTTP
+    job_result_max_wait: float = 60 # Longest a job result request may wait for the job to finish, in seconds
+    job_events_keepalive: float = 15 # Seconds between keepalive comments on idle job event streams
+    job_batch_max: int = 32 # Most jobs requested together in one batch
+
     # MCP
     MCP_DIR: str = portable_path(os.path.join(os.getcwd(), "models", "mcp"))
     mcp: list = list()
@@ -74,6 +118,7 @@ class Config(metaclass=Singleton):
             if field not in config_typings:
                 raise UnknownField(field)
             uncommitted[field] = config_typings[field](conf_d[field]) if conf_d[field] is not None else None # attempt cast to correct typing
+            self._check_field(field, uncommitted[field])
         
         # Commit config change request
         for field in uncommitted:
@@ -81,6 +126,20 @@ class Config(metaclass=Singleton):
             
         self.current_config = "Unsaved"
             
+    # Can raise: InvalidField
+    def _check_field(self, field: str, value):
+        '''Reject values that would otherwise only fail once they are used'''
+        if value is None: return
+        if field == "audio_output_codec":
+            codecs = [codec.value for codec in AudioCodec]
+            if value not in codecs: raise InvalidField(field, "{} is not one of {}".format(value, ", ".join(codecs)))
+        elif field == "response_graph":
+            from utils.pipeline import PipelineGraph, InvalidPipelineGraph # The pipeline uses the config, so only imported when needed
+            try:
+                PipelineGraph(value, default_queue_size=1)
+            except InvalidPipelineGraph as err:
+                raise InvalidField(field, str(err))
+            
     def save(self, config_name: str):
         with open(portable_path(os.path.join(self.CONFIG_DIR, config_name))) as f:
             yaml.dump(self.get_config_dict(),f)
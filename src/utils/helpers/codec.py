@@ -0,0 +1,61 @@
+'''
+Compression of outgoing audio
+
+Each chunk is encoded on its own into a complete file (FLAC stream or Ogg Opus
+stream) so clients can decode chunks independently. Opus only supports some
+sample rates and needs a recent libsndfile, so anything that can't be encoded
+as Opus falls back to FLAC, which is lossless. FLAC stops at 24 bit, so 32 bit
+audio is left as PCM rather than cut down.
+'''
+
+import io
+import logging
+from enum import Enum
+from typing import Tuple
+
+import numpy as np
+import soundfile
+
+class AudioCodec(Enum):
+    PCM = "pcm"
+    FLAC = "flac"
+    OPUS = "opus"
+
+OPUS_SAMPLE_RATES = (8000, 12000, 16000, 24000, 48000)
+_FLAC_SUBTYPES = {1: "PCM_16", 2: "PCM_16", 3: "PCM_24"} # 8 bit is widened to 16 bit first
+_DTYPES = {1: np.uint8, 2: np.int16, 4: np.int32}
+
+def _to_array(ab: bytes, sw: int, ch: int) -> np.ndarray:
+    if sw == 3:
+        # No 24 bit numpy type, so pad each sample to 32 bits
+        raw = np.frombuffer(ab, dtype=np.uint8).reshape(-1, 3)
+        data = (np.pad(raw, ((0, 0), (1, 0))).view("<i4")).reshape(-1)
+    else:
+        data = np.frombuffer(ab, dtype=_DTYPES[sw])
+        if sw == 1: data = (data.astype(np.int16) - 128) << 8 # 8 bit PCM is unsigned
+    return data.reshape(-1, ch)
+
+def _encode(ab: bytes, sr: int, sw: int, ch: int, codec: AudioCodec) -> bytes:
+    buffer = io.BytesIO()
+    data = _to_array(ab, sw, ch)
+    if codec == AudioCodec.OPUS:
+        if sr not in OPUS_SAMPLE_RATES: raise ValueError("Opus doesn't support sample rate {}".format(sr))
+        soundfile.write(buffer, data, sr, format="OGG", subtype="OPUS")
+    else:
+        soundfile.write(buffer, data, sr, format="FLAC", subtype=_FLAC_SUBTYPES[sw])
+    return buffer.getvalue()
+
+def encode_audio(ab: bytes, sr: int, sw: int, ch: int, codec: str) -> Tuple[bytes, str]:
+    '''Encode a chunk of PCM audio, returning the encoded bytes and the codec actually used'''
+    codec = AudioCodec(codec)
+    if codec == AudioCodec.PCM: return ab, codec.value
+
+    if codec == AudioCodec.OPUS:
+        try:
+            return _encode(ab, sr, sw, ch, AudioCodec.OPUS), AudioCodec.OPUS.value
+        except Exception as err:
+            logging.debug("Falling back to FLAC for audio chunk: {}".format(err))
+    if sw not in _FLAC_SUBTYPES:
+        logging.debug("Sending {} bit audio chunk as PCM, FLAC doesn't support it".format(sw*8))
+        return ab, AudioCodec.PCM.value
+    return _encode(ab, sr, sw, ch, AudioCodec.FLAC), AudioCodec.FLAC.value
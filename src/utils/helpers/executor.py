@@ -0,0 +1,44 @@
+'''
+Shared thread pool for running blocking code without stalling the event loop
+
+Operations that call blocking SDKs or do heavy compute are run here so
+websocket broadcasts, API endpoints and job cancellation stay responsive.
+'''
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Any
+
+from utils.config import Config
+from utils.helpers.singleton import Singleton
+
+class BlockingExecutor(metaclass=Singleton):
+    def __init__(self):
+        self.max_workers: int = max(Config().blocking_executor_workers, 1)
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="jaison-blocking")
+
+        self.submitted: int = 0 # Waiting for or running on a thread
+        self.completed: int = 0
+
+    def run(self, func: Callable, *args) -> asyncio.Future:
+        '''Run func(*args) on the pool, returning a future resolved on the event loop'''
+        loop = asyncio.get_running_loop()
+        self.submitted += 1
+        future = loop.run_in_executor(self.executor, func, *args)
+        future.add_done_callback(self._on_done)
+        return future
+
+    def _on_done(self, future: asyncio.Future):
+        self.submitted -= 1
+        self.completed += 1
+
+    def get_stats(self) -> dict:
+        return {
+            "max_workers": self.max_workers,
+            "in_flight": self.submitted,
+            "queued": max(self.submitted - self.max_workers, 0),
+            "completed": self.completed
+        }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
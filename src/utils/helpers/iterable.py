@@ -6,9 +6,4 @@ async def list_to_agen(target_list):
         
         
 def chunk_buffer(buf):
-    chunks = list()
-    while len(buf) > 0:
-        chunks.append(buf[:CHUNK_SIZE])
-        buf = buf[CHUNK_SIZE:]
-        
-    return chunks
\ No newline at end of file
+    return [buf[idx:idx+CHUNK_SIZE] for idx in range(0, len(buf), CHUNK_SIZE)]
\ No newline at end of file
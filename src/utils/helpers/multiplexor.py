@@ -1,44 +1,61 @@
 from typing import List, Callable, AsyncGenerator, Dict, Tuple
-import logging
 import asyncio
 
-async def _queue_to_generator(queue: asyncio.Queue, queue_event: asyncio.Event, finish_event: asyncio.Event):
+class _MultiplexEnd:
+    '''Marks the end of the input stream in a branch queue'''
+
+class _MultiplexError:
+    '''Carries an exception raised by the input stream to each branch'''
+    def __init__(self, err: BaseException):
+        self.err = err
+
+async def _queue_to_generator(queue: asyncio.Queue):
     while True:
-        await queue_event.wait()
-        if queue.empty():
-            queue_event.clear()
-            if finish_event.is_set(): break
-        else:
-            yield await queue.get()
-    
-async def _multiplex(in_stream: AsyncGenerator, queue_list: List[asyncio.Queue], queue_event_list: List[asyncio.Event], finish_event: asyncio.Event):
-    async for in_d in in_stream:
+        item = await queue.get()
+        if isinstance(item, _MultiplexEnd): break
+        if isinstance(item, _MultiplexError): raise item.err
+        yield item
+
+def _copy(item):
+    '''Shallow copy of a chunk, or of the chunk in a (kind, chunk) pipeline item'''
+    if isinstance(item, dict): return dict(item)
+    if isinstance(item, tuple) and len(item) == 2 and isinstance(item[1], dict): return (item[0], dict(item[1]))
+    return item
+
+async def _multiplex(in_stream: AsyncGenerator, queue_list: List[asyncio.Queue]):
+    try:
+        async for in_d in in_stream:
+            for q in queue_list:
+                # Each branch gets its own copy so they can't affect each other
+                await q.put(_copy(in_d))
+    except Exception as err:
         for q in queue_list:
-            await q.put(dict(in_d))
-        for qe in queue_event_list:
-            qe.set()
-            
-    for qe in queue_event_list:
-        qe.set()
-    finish_event.set()
-        
+            await q.put(_MultiplexError(err))
+        return
+
+    for q in queue_list:
+        await q.put(_MultiplexEnd())
+
 def multiplexor(
     func_d: Dict[str, Callable[[AsyncGenerator], AsyncGenerator | None]],
-    in_stream: AsyncGenerator
+    in_stream: AsyncGenerator,
+    maxsize: int = 0
 ) -> Tuple[Dict[str, AsyncGenerator], asyncio.Task]:
+    '''
+    Fan out one stream to several consumers
+
+    Every item from in_stream is handed to each function in func_d through its own queue.
+    With a maxsize, a slow branch holds back the input stream instead of buffering without limit.
+    '''
     queue_list: List[asyncio.Queue] = list()
-    queue_event_list: List[asyncio.Event] = list()
-    stream_end_event = asyncio.Event()
-    
+
     result_d = dict()
     for fun_key in func_d:
-        q = asyncio.Queue()
-        q_event = asyncio.Event()
-        agen = func_d[fun_key](_queue_to_generator(q,q_event,stream_end_event))
+        q = asyncio.Queue(maxsize=maxsize)
+        agen = func_d[fun_key](_queue_to_generator(q))
         result_d[fun_key] = agen
         queue_list.append(q)
-        queue_event_list.append(q_event)
-        
-    multi_task = asyncio.create_task(_multiplex(in_stream, queue_list, queue_event_list, stream_end_event))
-    
-    return result_d, multi_task
\ No newline at end of file
+
+    multi_task = asyncio.create_task(_multiplex(in_stream, queue_list))
+
+    return result_d, multi_task
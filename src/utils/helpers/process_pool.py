@@ -0,0 +1,200 @@
+'''
+Warm worker processes for CPU-heavy operations
+
+Each worker is a separate process (spawned, so it works the same on every
+platform) that loads its model once with init_func and then serves requests
+with handle_func until closed. Running inference in another process keeps the
+GIL of the main process free, and several workers let consecutive requests
+use separate cores at the same time.
+
+Request and result bytes (PCM) go through shared memory instead of being
+pickled through the pipe. Every worker has an input buffer owned by the main
+process and an output buffer owned by the worker, both reused and only grown
+when a larger payload comes along. Only small parameters and metadata are
+pickled.
+
+init_func and handle_func must be defined at module level so the worker can
+import them. handle_func(state, data, params) gets the state returned by
+init_func, a memoryview of the request bytes (only valid during the call) and
+the params dict, and returns (result_bytes, metadata_dict).
+'''
+
+import logging
+import queue
+import multiprocessing
+from multiprocessing.shared_memory import SharedMemory
+from typing import Callable, Dict, Any, Tuple, List
+
+class WorkerError(Exception):
+    def __init__(self, pool_name: str, reason: str):
+        super().__init__("Worker process of {} failed: {}".format(pool_name, reason))
+
+def _resize(shm: SharedMemory, size: int, create: bool) -> SharedMemory:
+    '''Get a shared memory block of at least size bytes, reusing shm if it is big enough'''
+    if shm is not None and shm.size >= size: return shm
+    if shm is not None:
+        shm.close()
+        shm.unlink()
+    return SharedMemory(create=create, size=max(size, 2*shm.size if shm else 0, 1))
+
+def _worker_main(conn, init_func: Callable, handle_func: Callable, init_args: tuple):
+    try:
+        state = init_func(*init_args)
+    except Exception as err:
+        conn.send(("error", "{}: {}".format(type(err).__name__, err)))
+        return
+    conn.send(("ready", None))
+
+    in_shm, out_shm = None, None
+    try:
+        while True:
+            try:
+                msg = conn.recv()
+            except EOFError:
+                break
+            if msg is None: break
+
+            in_name, in_size, params = msg
+            try:
+                if in_name is not None and (in_shm is None or in_shm.name != in_name):
+                    if in_shm is not None: in_shm.close()
+                    in_shm = SharedMemory(name=in_name)
+
+                if in_name is not None:
+                    with in_shm.buf[:in_size] as data:
+                        result, meta = handle_func(state, data, params)
+                else:
+                    result, meta = handle_func(state, memoryview(b""), params)
+
+                out_shm = _resize(out_shm, len(result), True)
+                out_shm.buf[:len(result)] = result
+                conn.send(("ok", (out_shm.name, len(result), meta)))
+            except Exception as err:
+                conn.send(("error", "{}: {}".format(type(err).__name__, err)))
+    finally:
+        if in_shm is not None: in_shm.close()
+        if out_shm is not None:
+            out_shm.close()
+            out_shm.unlink()
+
+class _WorkerSlot():
+    def __init__(self, pool: "ProcessWorkerPool"):
+        self.pool = pool
+        self.process = None
+        self.conn = None
+        self.in_shm: SharedMemory = None
+        self.out_shm: SharedMemory = None
+
+    def spawn(self):
+        parent_conn, child_conn = self.pool.context.Pipe()
+        self.process = self.pool.context.Process(
+            target=_worker_main,
+            args=(child_conn, self.pool.init_func, self.pool.handle_func, self.pool.init_args),
+            name="{}-worker".format(self.pool.name),
+            daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self.conn = parent_conn
+
+        status, reason = self._recv()
+        if status != "ready": raise WorkerError(self.pool.name, reason)
+
+    def request(self, data: bytes, params: Dict[str, Any]) -> Tuple[bytes, Dict[str, Any]]:
+        if self.process is None or not self.process.is_alive():
+            logging.warning("Worker process of {} is not running, restarting it".format(self.pool.name))
+            self.kill()
+            self.spawn()
+
+        in_name = None
+        if data:
+            self.in_shm = _resize(self.in_shm, len(data), True)
+            self.in_shm.buf[:len(data)] = data
+            in_name = self.in_shm.name
+
+        self.conn.send((in_name, len(data), params))
+        status, result = self._recv()
+        if status != "ok": raise WorkerError(self.pool.name, result)
+
+        out_name, out_size, meta = result
+        if self.out_shm is None or self.out_shm.name != out_name:
+            if self.out_shm is not None: self.out_shm.close()
+            self.out_shm = SharedMemory(name=out_name)
+        return bytes(self.out_shm.buf[:out_size]), meta
+
+    def _recv(self):
+        try:
+            return self.conn.recv()
+        except EOFError:
+            self.kill()
+            raise WorkerError(self.pool.name, "process exited unexpectedly")
+
+    def close(self):
+        if self.conn is not None:
+            try:
+                self.conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        if self.process is not None:
+            self.process.join(timeout=5)
+        self.kill()
+
+    def kill(self):
+        if self.process is not None and self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.process = None
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+        if self.out_shm is not None:
+            self.out_shm.close()
+            try:
+                self.out_shm.unlink() # Worker frees it on a clean exit, but not if it died
+            except FileNotFoundError:
+                pass
+            self.out_shm = None
+        if self.in_shm is not None:
+            self.in_shm.close()
+            self.in_shm.unlink()
+            self.in_shm = None
+
+class ProcessWorkerPool():
+    def __init__(self, name: str, workers: int, init_func: Callable, handle_func: Callable, init_args: tuple = ()):
+        self.name = name
+        self.workers = workers
+        self.init_func = init_func
+        self.handle_func = handle_func
+        self.init_args = init_args
+
+        self.context = multiprocessing.get_context("spawn")
+        self.slots: List[_WorkerSlot] = list()
+        self.idle: queue.Queue = queue.Queue()
+
+    def start(self) -> None:
+        '''Spawn all workers and wait for their models to load. Blocking'''
+        try:
+            for _ in range(self.workers):
+                slot = _WorkerSlot(self)
+                self.slots.append(slot)
+                slot.spawn()
+                self.idle.put(slot)
+        except Exception:
+            self.close()
+            raise
+        logging.info("Started {} worker process(es) for {}".format(self.workers, self.name))
+
+    def run(self, data: bytes = b"", params: Dict[str, Any] = None) -> Tuple[bytes, Dict[str, Any]]:
+        '''Process a request on the next free worker. Blocking and thread-safe'''
+        slot = self.idle.get()
+        try:
+            return slot.request(data, params or dict())
+        finally:
+            self.idle.put(slot)
+
+    def close(self) -> None:
+        '''Stop all workers and free their buffers. Blocking'''
+        for slot in self.slots:
+            slot.close()
+        self.slots = list()
+        self.idle = queue.Queue()
@@ -0,0 +1,52 @@
+'''
+Incremental sentence boundary detection for streamed text
+
+Text is fed in as it is generated and completed sentences are handed back
+as soon as their terminating punctuation and following whitespace is seen.
+Whatever is left over once the stream ends is retrieved with flush.
+'''
+
+import re
+from typing import List
+
+class SentenceBuffer():
+    BOUNDARY_PATTERN = re.compile(r"[.!?…]+[\"'”’)\]]*\s+|\n+")
+    ABBREVIATIONS = {"mr.", "mrs.", "ms.", "dr.", "prof.", "sr.", "jr.", "st.", "vs.", "etc.", "e.g.", "i.e."}
+
+    def __init__(self, min_length: int = 1):
+        self.min_length = min_length
+        self.buffer: str = ""
+        self.scan_pos: int = 0 # Everything before this has already been checked for boundaries
+
+    def feed(self, text: str) -> List[str]:
+        '''Add text to the buffer and return any sentences completed by it'''
+        self.buffer += text
+
+        sentences = list()
+        start = 0
+        for match in self.BOUNDARY_PATTERN.finditer(self.buffer, self.scan_pos):
+            end = match.end()
+            if end == len(self.buffer) and not self.buffer[-1] == "\n":
+                # Trailing whitespace may still be followed by more punctuation or quotes
+                break
+            candidate = self.buffer[start:end].strip()
+            self.scan_pos = end
+            if self._is_abbreviation(candidate) or len(candidate) < self.min_length:
+                continue
+            sentences.append(candidate)
+            start = end
+
+        self.buffer = self.buffer[start:]
+        self.scan_pos = max(self.scan_pos - start, 0)
+        return sentences
+
+    def flush(self) -> str:
+        '''Return whatever text remains as the final sentence and reset'''
+        remainder = self.buffer.strip()
+        self.buffer = ""
+        self.scan_pos = 0
+        return remainder
+
+    def _is_abbreviation(self, candidate: str) -> bool:
+        last_word = candidate.rsplit(maxsplit=1)[-1].lower() if candidate else ""
+        return last_word in self.ABBREVIATIONS
@@ -3,14 +3,21 @@ import asyncio
 import uuid
 import base64
 import datetime
-from typing import Dict, Coroutine, List, Any, Tuple
+import time
+from typing import Dict, Coroutine, List, Any, Tuple, AsyncGenerator
 from enum import Enum
 
 from utils.helpers.singleton import Singleton
-from utils.helpers.iterable import chunk_buffer
+from utils.helpers.iterable import list_to_agen
 from utils.helpers.observer import ObserverServer
+from utils.helpers.executor import BlockingExecutor
+from utils.helpers.sentence import SentenceBuffer
+from utils.helpers.codec import encode_audio
 
-from utils.config import Config, UnknownField, UnknownFile
+from utils.config import Config, UnknownField, InvalidField, UnknownFile
+from utils.metrics import Metrics
+from utils.tracing import Tracer
+from utils.scheduler import JobScheduler, Resource, Access
 from utils.prompter import Prompter
 from utils.prompter.message import (
     RawMessage,
@@ -34,6 +41,7 @@ from utils.operations import (
     UsedInactiveError
 )
 from utils.mcp import MCPManager
+from utils.pipeline import PipelineGraph, InvalidPipelineGraph
 
 class NonexistantJobException(Exception):
     pass
@@ -41,6 +49,12 @@ class NonexistantJobException(Exception):
 class UnknownJobType(Exception):
     pass
 
+class JobExpired(Exception):
+    pass
+
+class JobSuperseded(Exception):
+    pass
+
 class JobType(Enum):
     RESPONSE = 'response'
     CONTEXT_CLEAR = 'context_clear'
@@ -63,14 +77,13 @@ class JobType(Enum):
 class JAIson(metaclass=Singleton):
     def __init__(self): # attribute stubs
         self.job_loop: asyncio.Task = None
-        self.job_queue: asyncio.Queue = None
+        self.scheduler: JobScheduler = None
         self.job_map: Dict[str, Tuple[JobType, Coroutine]] = None
-        self.job_current_id: str = None
-        self.job_current: asyncio.Task = None
-        self.job_skips: dict = None
-        
-        # Any asyncio.Tasks in this list will be cancelled before the next job runs
-        self.tasks_to_clean: List = list()
+        self.job_running: Dict[str, asyncio.Task] = None
+        self.job_skips: Dict[str, str] = None # Queued jobs flagged to cancel with reasons
+        self.job_queued_time: Dict[str, float] = None # perf_counter when each queued job was queued
+        self.job_batches: Dict[str, List[Tuple[str, Dict[str, Any]]]] = None # Queued text context jobs merged into the first of them
+        self.job_deadlines: Dict[str, float] = None # perf_counter after which a queued job is dropped instead of started
         
         self.event_server: ObserverServer = None
         
@@ -81,9 +94,13 @@ class JAIson(metaclass=Singleton):
     
     async def start(self):
         logging.info("Starting JAIson application layer.")
-        self.job_queue = asyncio.Queue()
+        self.scheduler = JobScheduler(max_running=Config().job_max_concurrent)
         self.job_map = dict()
+        self.job_running = dict()
         self.job_skips = dict()
+        self.job_queued_time = dict()
+        self.job_batches = dict()
+        self.job_deadlines = dict()
         self.job_loop = asyncio.create_task(self._process_job_loop())
         
         self.event_server = ObserverServer()
@@ -105,16 +122,52 @@ class JAIson(metaclass=Singleton):
         await self.op_manager.close_operation_all()
         await self.mcp_manager.close()
         await self.process_manager.unload()
+        BlockingExecutor().shutdown()
         logging.info("JAIson application layer has been shut down")
     
     ## Job Queueing #########################
     
-    # Add async task to Queue to be ran in the order it was requested
+    # Add async task to be ran once nothing requested before it conflicts with it
     async def create_job(self, job_type: Enum, **kwargs):
+        return (await self.create_jobs([(job_type, kwargs)]))[0]
+    
+    async def create_jobs(self, specs: List[Tuple[Enum, Dict[str, Any]]]) -> List[str]:
+        '''Queue jobs in order right after one another, without other jobs getting queued between them. If any is invalid, none are queued'''
+        jobs = list()
+        try:
+            for job_type, kwargs in specs: jobs.append(self._prepare_job(job_type, dict(kwargs)))
+            
+            # Jobs dropped to make way are ones requested before all of these
+            for new_job_id, job_type_enum, coro, kwargs, options in jobs:
+                if options.get("supersede", False): await self._supersede_jobs(new_job_id, JobType.RESPONSE)
+                if options.get("interrupt", False): await self._interrupt_jobs(new_job_id, JobType.RESPONSE)
+        except BaseException:
+            for _, _, coro, _, _ in jobs:
+                if coro is not None: coro.close()
+            raise
+        
+        # Nothing is awaited from here on, so other requests can't queue jobs in between
+        for new_job_id, job_type_enum, coro, kwargs, options in jobs:
+            self._queue_job(new_job_id, job_type_enum, coro, kwargs, options.get("deadline", None))
+        Metrics().job_queue_depth.set(self._queue_depth())
+        return [job[0] for job in jobs]
+    
+    def _prepare_job(self, job_type: Enum, kwargs: Dict[str, Any]) -> Tuple[str, JobType, Coroutine, Dict[str, Any], Dict[str, Any]]:
+        '''Validate a job request and make its coroutine without queueing it'''
         new_job_id = str(uuid.uuid4())
         
         job_type_enum = JobType(job_type)
         
+        options = dict()
+        if job_type_enum == JobType.RESPONSE:
+            options["deadline"] = self._job_deadline(kwargs.pop("max_queue_age", None), kwargs.pop("deadline", None))
+            supersede = kwargs.pop("supersede", None)
+            options["supersede"] = Config().response_supersede if supersede is None else supersede
+        elif job_type_enum == JobType.CONTEXT_CONVERSATION_ADD_AUDIO:
+            interrupt = kwargs.pop("interrupt", None)
+            options["interrupt"] = Config().audio_interrupts_response if interrupt is None else interrupt
+        
+        # Making the coroutine checks its arguments, so bad requests fail here
         coro = None
         if job_type_enum == JobType.RESPONSE: coro = self.response_pipeline(new_job_id, job_type_enum, **kwargs)
         elif job_type_enum == JobType.CONTEXT_REQUEST_ADD: coro = self.append_request_context(new_job_id, job_type_enum, **kwargs)
@@ -133,12 +186,134 @@ class JAIson(metaclass=Singleton):
         elif job_type_enum == JobType.CONFIG_LOAD: coro = self.load_config(new_job_id, job_type_enum, **kwargs)
         elif job_type_enum == JobType.CONFIG_UPDATE: coro = self.update_config(new_job_id, job_type_enum, **kwargs)
         elif job_type_enum == JobType.CONFIG_SAVE: coro = self.save_config(new_job_id, job_type_enum, **kwargs)
+        return new_job_id, job_type_enum, coro, kwargs, options
+    
+    def _queue_job(self, new_job_id: str, job_type_enum: JobType, coro: Coroutine, kwargs: Dict[str, Any], deadline: float = None):
+        '''Hand a prepared job to the scheduler, or to the text batch it joins'''
+        if job_type_enum == JobType.CONTEXT_CONVERSATION_ADD_TEXT and self._add_to_batch(new_job_id, kwargs):
+            if coro is not None: coro.close() # Run by the batch instead
+            self.job_map[new_job_id] = (job_type_enum, None)
+            self.job_queued_time[new_job_id] = time.perf_counter()
+            logging.info("Queued new {} job {} into batch".format(job_type_enum.value, new_job_id))
+            return
+        
+        if deadline is not None: self.job_deadlines[new_job_id] = deadline
         self.job_map[new_job_id] = (job_type_enum, coro)
+        self.job_queued_time[new_job_id] = time.perf_counter()
         
-        await self.job_queue.put(new_job_id)
+        if job_type_enum == JobType.CONTEXT_CONVERSATION_ADD_TEXT and Config().context_batch_max > 1:
+            self.job_batches[new_job_id] = [(new_job_id, kwargs)]
+        
+        self.scheduler.submit(new_job_id, self._job_claims(job_type_enum, kwargs))
         
         logging.info("Queued new {} job {}".format(job_type_enum.value, new_job_id))
-        return new_job_id
+    
+    def _add_to_batch(self, job_id: str, kwargs: Dict[str, Any]) -> bool:
+        '''Merge a text context job into the job requested right before it if that one is the same kind and still waiting'''
+        leader_id = self.scheduler.last_job()
+        if leader_id not in self.job_batches or not self.scheduler.is_waiting(leader_id): return False
+        if len(self.job_batches[leader_id]) >= Config().context_batch_max: return False
+        
+        self.job_batches[leader_id].append((job_id, kwargs))
+        return True
+    
+    def _job_deadline(self, max_queue_age: float = None, deadline: float = None) -> float:
+        '''Earliest of max_queue_age seconds from now and UNIX timestamp deadline as a perf_counter, None if neither'''
+        if max_queue_age is None: max_queue_age = Config().response_max_queue_age
+        now = time.perf_counter()
+        
+        deadlines = list()
+        if max_queue_age: deadlines.append(now + float(max_queue_age))
+        if deadline: deadlines.append(now + (float(deadline) - time.time()))
+        return min(deadlines) if deadlines else None
+    
+    async def _supersede_jobs(self, job_id: str, job_type: JobType):
+        '''Drop all waiting jobs of job_type in favor of job_id'''
+        for queued_id, (queued_type, _) in list(self.job_map.items()):
+            if queued_type == job_type and self.scheduler.is_waiting(queued_id):
+                await self._drop_queued_job(queued_id, JobSuperseded(f"Job {queued_id} was superseded by job {job_id}"), "superseded")
+    
+    async def _interrupt_jobs(self, job_id: str, job_type: JobType):
+        '''Cancel running jobs of job_type right away and drop waiting ones in favor of job_id (barge-in)'''
+        reason = f"interrupted by job {job_id}"
+        for other_id, (other_type, _) in list(self.job_map.items()):
+            if other_type != job_type: continue
+            if other_id in self.job_running:
+                logging.info(f"Setting job {other_id} to cancel because {reason}")
+                self.job_running[other_id].cancel(f"Job {other_id} {reason}")
+            elif self.scheduler.is_waiting(other_id):
+                await self._drop_queued_job(other_id, asyncio.CancelledError(f"Job {other_id} {reason}"), "interrupted")
+    
+    async def _expire_jobs(self) -> float:
+        '''Drop waiting jobs past their deadline. Returns seconds until the next deadline, None if there is none'''
+        now = time.perf_counter()
+        for job_id, deadline in list(self.job_deadlines.items()):
+            if deadline <= now and self.scheduler.is_waiting(job_id):
+                await self._drop_queued_job(job_id, JobExpired(f"Job {job_id} expired before it could start"), "expired")
+        
+        waiting = [deadline for job_id, deadline in self.job_deadlines.items() if self.scheduler.is_waiting(job_id)]
+        return max(min(waiting) - now, 0) if waiting else None
+    
+    async def _drop_queued_job(self, job_id: str, err: Exception, reason: str):
+        job_type, coro = self.job_map.pop(job_id)
+        if coro is not None: coro.close()
+        self.job_skips.pop(job_id, None)
+        self.job_queued_time.pop(job_id, None)
+        self.job_deadlines.pop(job_id, None)
+        self.scheduler.finish(job_id)
+        
+        logging.info("Dropped queued {} job {} ({})".format(job_type.value, job_id, reason))
+        Metrics().job_dropped.inc(job_type=job_type.value, reason=reason)
+        await self._handle_broadcast_error(job_id, job_type, err)
+    
+    def _queue_depth(self) -> int:
+        batched = sum(len(batch)-1 for leader_id, batch in self.job_batches.items() if self.scheduler.is_waiting(leader_id))
+        return self.scheduler.waiting_count() + batched
+    
+    def _job_claims(self, job_type: JobType, kwargs: Dict[str, Any]) -> Dict[str, Access]:
+        '''Resources a job uses and how, deciding what it may run alongside'''
+        op_roles = [Resource.op(role.value) for role in OpRoles]
+        match job_type:
+            case JobType.RESPONSE:
+                # Responses never overlap. Prompter is changed by the MCP pre-pass, and once the prompt
+                # is taken it is downgraded to READ and history to APPEND
+                response_roles = [OpRoles.MCP, OpRoles.T2T, OpRoles.TTS, OpRoles.FILTER_TEXT, OpRoles.FILTER_AUDIO]
+                return {Resource.RESPONSE: Access.WRITE, Resource.HISTORY: Access.READ, Resource.PROMPTER: Access.WRITE, Resource.CONFIG: Access.READ} \
+                    | {Resource.op(role.value): Access.READ for role in response_roles}
+            case JobType.CONTEXT_REQUEST_ADD | JobType.CONTEXT_CONVERSATION_ADD_TEXT | JobType.CONTEXT_CUSTOM_ADD:
+                return {Resource.HISTORY: Access.APPEND, Resource.PROMPTER: Access.READ}
+            case JobType.CONTEXT_CONVERSATION_ADD_AUDIO:
+                return {Resource.HISTORY: Access.APPEND, Resource.PROMPTER: Access.READ, Resource.op(OpRoles.STT.value): Access.READ}
+            case JobType.CONTEXT_CLEAR:
+                return {Resource.HISTORY: Access.WRITE}
+            case JobType.CONTEXT_CONFIGURE:
+                return {Resource.HISTORY: Access.WRITE, Resource.PROMPTER: Access.WRITE}
+            case JobType.CONTEXT_CUSTOM_REGISTER | JobType.CONTEXT_CUSTOM_REMOVE:
+                return {Resource.PROMPTER: Access.WRITE}
+            case JobType.OPERATION_LOAD | JobType.OPERATION_UNLOAD | JobType.OPERATION_CONFIGURE:
+                claims = dict()
+                for op_d in kwargs.get("ops", None) or []:
+                    role = op_d.get("role", None) if isinstance(op_d, dict) else None
+                    if role in [op_role.value for op_role in OpRoles]: claims[Resource.op(role)] = Access.WRITE
+                    else: return {resource: Access.WRITE for resource in op_roles} # Fails when run, but keep it in order
+                return claims
+            case JobType.OPERATION_CONFIG_RELOAD:
+                return {Resource.CONFIG: Access.READ} | {resource: Access.WRITE for resource in op_roles}
+            case JobType.OPERATION_USE:
+                role = kwargs.get("role", None)
+                if role in [op_role.value for op_role in OpRoles]: return {Resource.op(role): Access.READ}
+                return {resource: Access.READ for resource in op_roles}
+            case JobType.CONFIG_UPDATE:
+                return {Resource.CONFIG: Access.WRITE}
+            case JobType.CONFIG_SAVE:
+                return {Resource.CONFIG: Access.READ}
+            case _:
+                # Anything else (loading a config) runs on its own
+                return {resource: Access.WRITE for resource in [Resource.HISTORY, Resource.PROMPTER, Resource.CONFIG] + op_roles}
+    
+    def has_job(self, job_id: str) -> bool:
+        '''Whether a job is queued or running'''
+        return job_id in self.job_map
     
     async def cancel_job(self, job_id: str, reason: str = None):
         if job_id not in self.job_map: raise NonexistantJobException(f"Job {job_id} does not exist or already finished")
@@ -147,60 +322,79 @@ class JAIson(metaclass=Singleton):
         if reason: cancel_message += f" because {reason}"
         logging.info(cancel_message)
 
-        if job_id == self.job_current_id:
+        if job_id in self.job_running:
             # If job is already running
-            self._clear_current_job(reason=cancel_message)
+            self.job_running[job_id].cancel(cancel_message)
         else: 
-            # If job is still in Queue
-            # Simply flag to skip. Unzipping queue can potentially process a job out of order 
-            self.job_skips[job_id](cancel_message)
-            
-    def _clear_current_job(self, reason: str = None):
-        self.job_map.pop(self.job_current_id, None)
-        self.job_skips.pop(self.job_current_id, None)
-        self.job_current_id = None
-        
-        for task in self.tasks_to_clean:
-            task.cancel(reason)
-        self.tasks_to_clean.clear()
+            # If job is still queued
+            # Simply flag to skip. It is reported once it would have started so events stay in order
+            self.job_skips[job_id] = cancel_message
         
-        if self.job_current is not None:
-            self.job_current.cancel(reason)
-            self.job_current = None
-        
-    # Side loop responsible for processing the next job in the Queue
+    # Side loop responsible for starting queued jobs once nothing before them conflicts
     async def _process_job_loop(self):
+        next_deadline = None
         while True:
             try:
+                await self.scheduler.wait(timeout=next_deadline)
+                next_deadline = await self._expire_jobs()
                 await self.process_manager.reload()
                 await self.process_manager.unload()
                 
-                self.job_current_id = await self.job_queue.get()
-                job_type, coro = self.job_map[self.job_current_id]
-                
-                if self.job_current_id in self.job_skips:
-                    # Skip cancelled jobs
-                    reason = self.job_skips[self.job_current_id]
-                    await self._handle_broadcast_error(self.job_current_id, job_type, asyncio.CancelledError(reason))
-                    self._clear_current_job(reason=reason)
-                    del coro
-                else:
-                    # Run and wait for completion
-                    self.job_current = asyncio.create_task(coro)
-                    await asyncio.wait([self.job_current])
-                    
-                    # Handle finishing with error
-                    err = self.job_current.exception() if self.job_current else None
-                    if err is not None:
-                        logging.warning(f"Job was cancelled due to an error: {err}", exc_info=err)
-                        await self._handle_broadcast_error(self.job_current_id, job_type, err)
+                metrics = Metrics()
+                for job_id in self.scheduler.take_ready():
+                    job_type, _ = self.job_map[job_id]
+                    queued_time = self.job_queued_time.pop(job_id, None)
+                    if queued_time is not None:
+                        metrics.job_queue_wait_ms.observe((time.perf_counter()-queued_time)*1000, job_type=job_type.value)
                     
-                    # Cleanup
-                    self._clear_current_job()
+                    # Trace everything the job does
+                    trace_token = Tracer().start_trace(job_id, job_type.value)
+                    try:
+                        self.job_running[job_id] = asyncio.create_task(self._run_job(job_id))
+                    finally:
+                        Tracer().end_trace(trace_token)
+                metrics.job_queue_depth.set(self._queue_depth())
             except Exception as err:
                 logging.error("Encountered error in main job processing loop", exc_info=True)
                 await asyncio.sleep(1)
                 
+    async def _run_job(self, job_id: str):
+        job_type, coro = self.job_map[job_id]
+        batch = self.job_batches.pop(job_id, None)
+        try:
+            if batch is not None and len(batch) > 1:
+                # Jobs merged into this one are reported individually by the batch
+                coro.close()
+                with Tracer().job_span(batch_size=len(batch)):
+                    await self.append_conversation_context_text_batch(job_type, batch)
+                return
+            
+            if job_id in self.job_skips:
+                # Skip cancelled jobs
+                coro.close()
+                await self._handle_broadcast_error(job_id, job_type, asyncio.CancelledError(self.job_skips[job_id]))
+                return
+            
+            try:
+                with Tracer().job_span():
+                    await coro
+            except asyncio.CancelledError as err:
+                logging.info("Job {} was cancelled".format(job_id))
+                await self._handle_broadcast_error(job_id, job_type, err)
+            except Exception as err:
+                logging.warning(f"Job was cancelled due to an error: {err}", exc_info=err)
+                await self._handle_broadcast_error(job_id, job_type, err)
+        finally:
+            for batched_id, _ in (batch or [])[1:]:
+                self.job_map.pop(batched_id, None)
+                self.job_skips.pop(batched_id, None)
+            self.job_map.pop(job_id, None)
+            self.job_skips.pop(job_id, None)
+            self.job_deadlines.pop(job_id, None)
+            self.job_running.pop(job_id, None)
+            self.scheduler.finish(job_id)
+            Tracer().finish_trace(job_id)
+                
     ## Regular Request Handlers ###################
     
     def get_loaded_operations(self):
@@ -215,6 +409,24 @@ class JAIson(metaclass=Singleton):
                 
         return op_d
                 
+    def get_operation_stats(self):
+        return self.op_manager.get_execution_stats()
+    
+    def get_metrics(self) -> str:
+        metrics = Metrics()
+        
+        # Refresh point-in-time values before rendering
+        stats = self.op_manager.get_execution_stats()
+        metrics.executor_queued.set(stats["executor"]["queued"])
+        metrics.op_running.clear()
+        metrics.op_queued.clear()
+        for role, op_stats in stats["operations"].items():
+            for op_id, op_stat in op_stats.items():
+                metrics.op_running.set(op_stat["running"], role=role, op_id=op_id)
+                metrics.op_queued.set(op_stat["queued"], role=role, op_id=op_id)
+        
+        return metrics.render()
+                
     def get_current_config(self):
         return Config().get_config_dict()
             
@@ -228,63 +440,118 @@ class JAIson(metaclass=Singleton):
         self,
         job_id: str,
         job_type: JobType,
-        include_audio: bool = True
+        include_audio: bool = True,
+        stream: bool = None,
+        stream_tokens: bool = None
     ):
-        
+
         # Adjust flags based on loaded ops
         if not self.op_manager.get_operation(OpRoles.TTS): include_audio = False
-        
+        if stream is None: stream = Config().response_streaming
+        if stream_tokens is None: stream_tokens = Config().response_stream_tokens
+
         # Broadcast start conditions
-        await self._handle_broadcast_start(job_id, job_type, {"include_audio": include_audio})
+        await self._handle_broadcast_start(job_id, job_type, {"include_audio": include_audio, "stream": stream, "stream_tokens": stream_tokens})
     
         # Handle MCP stuff
         if self.op_manager.get_operation(OpRoles.MCP):
-            self.prompter.add_mcp_usage_prompt(self.mcp_manager.get_tooling_prompt(), self.mcp_manager.get_response_prompt())
-            mcp_sys_prompt, mcp_user_prompt = self.prompter.generate_mcp_system_context(), self.prompter.generate_mcp_user_context()
-            tooling_response = ""
-            async for chunk in self.op_manager.use_operation(OpRoles.MCP, {"instruction_prompt": mcp_sys_prompt, "messages": [RawMessage(mcp_user_prompt)]}):
-                tooling_response += chunk['content']
+            with Tracer().span("response.mcp"):
+                self.prompter.add_mcp_usage_prompt(self.mcp_manager.get_tooling_prompt(), self.mcp_manager.get_response_prompt())
+                mcp_sys_prompt, mcp_user_prompt = self.prompter.generate_mcp_system_context(), self.prompter.generate_mcp_user_context()
+                tooling_response = ""
+                async for chunk in self.op_manager.use_operation(OpRoles.MCP, {"instruction_prompt": mcp_sys_prompt, "messages": [RawMessage(mcp_user_prompt)]}):
+                    tooling_response += chunk['content']
 
-            ## Perform MCP tool calls
-            tool_call_results = await self.mcp_manager.use(tooling_response)
-            
-            ## Add results and usage prompt to prompter
-            self.prompter.add_mcp_results(tool_call_results)
+                ## Perform MCP tool calls
+                tool_call_results = await self.mcp_manager.use(tooling_response)
+                
+                ## Add results and usage prompt to prompter
+                self.prompter.add_mcp_results(tool_call_results)
 
         # Get prompts
-        instruction_prompt, history = self.prompter.get_sys_prompt(), self.prompter.get_history()
+        instruction_prompt, history = self.prompter.get_sys_prompt(), list(self.prompter.get_history())
         
-        # Appy t2t
-        t2t_result = ""
-        async for chunk_out in self.op_manager.use_operation(OpRoles.T2T, {"instruction_prompt": instruction_prompt, "messages": history}):
-            t2t_result += chunk_out["content"]
-        
-        # Broadcast raw results
-        await self._handle_broadcast_event(job_id, job_type, {"instruction_prompt": instruction_prompt})
-        await self._handle_broadcast_event(job_id, job_type, {"history": [msg.to_dict() for msg in history]})
-        await self._handle_broadcast_event(job_id, job_type, {"raw_content": t2t_result})
+        # Jobs adding to history may run from here, later lines are added after this prompt's
+        self.scheduler.downgrade(job_id, Resource.HISTORY, Access.APPEND)
+        self.scheduler.downgrade(job_id, Resource.PROMPTER, Access.READ)
+
+        if stream or stream_tokens:
+            # Prompts are broadcast first since results start coming before T2T finishes
+            await self._handle_broadcast_event(job_id, job_type, {"instruction_prompt": instruction_prompt})
+            await self._handle_broadcast_event(job_id, job_type, {"history": [msg.to_dict() for msg in history]})
+
+        t2t_stream = self._stream_t2t(job_id, job_type, instruction_prompt, list(history), stream_tokens)
+        if stream:
+            # Appy t2t, handing over sentences to the rest of the pipeline as soon as they complete
+            t2t_parts = list()
+            await self._respond_with_text(job_id, job_type, self._stream_t2t_sentences(t2t_stream, t2t_parts), include_audio)
+
+            await self._handle_broadcast_event(job_id, job_type, {"raw_content": "".join(t2t_parts)})
+        else:
+            # Appy t2t
+            t2t_result = ""
+            with Tracer().span("response.t2t"):
+                async for content in t2t_stream:
+                    t2t_result += content
+
+            # Broadcast raw results
+            if not stream_tokens:
+                await self._handle_broadcast_event(job_id, job_type, {"instruction_prompt": instruction_prompt})
+                await self._handle_broadcast_event(job_id, job_type, {"history": [msg.to_dict() for msg in history]})
+            await self._handle_broadcast_event(job_id, job_type, {"raw_content": t2t_result})
+
+            await self._respond_with_text(job_id, job_type, list_to_agen([t2t_result]), include_audio)
 
-        # Apply text filters
-        async for text_chunk_out in self.op_manager.use_operation(OpRoles.FILTER_TEXT, {"content": t2t_result}):
-            self.prompter.add_chat(self.prompter.character_name, text_chunk_out['content'])
-            await self._handle_broadcast_event(job_id, job_type, text_chunk_out)
-            if include_audio:
-                # Apply tts
-                async for audio_chunk_out in self.op_manager.use_operation(OpRoles.TTS, text_chunk_out):
-                    # Apply tts filters
-                    async for final_audio_chunk_out in self.op_manager.use_operation(OpRoles.FILTER_AUDIO, audio_chunk_out):
-                        # Broadcast results (only the audio data for now)
-                        for ws_chunk in chunk_buffer(base64.b64encode(final_audio_chunk_out['audio_bytes']).decode('utf-8')):
-                            await self._handle_broadcast_event(job_id, job_type, {
-                                "audio_bytes": ws_chunk,
-                                "sr": final_audio_chunk_out['sr'],
-                                "sw": final_audio_chunk_out['sw'],
-                                "ch": final_audio_chunk_out['ch']
-                            })
-                        
         # Broadcast completion
         await self._handle_broadcast_success(job_id, job_type)
 
+    async def _stream_t2t(self, job_id: str, job_type: JobType, instruction_prompt: str, history: List, stream_tokens: bool) -> AsyncGenerator[str, None]:
+        '''Apply t2t, yielding its output as it comes. Also broadcasts each piece with stream_tokens'''
+        token_seq = 0
+        async for chunk_out in self.op_manager.use_operation(OpRoles.T2T, {"instruction_prompt": instruction_prompt, "messages": history}):
+            if stream_tokens and chunk_out["content"]:
+                await self._handle_broadcast_event(job_id, job_type, {"t2t_token": chunk_out["content"], "token_seq": token_seq})
+                token_seq += 1
+            yield chunk_out["content"]
+
+    async def _stream_t2t_sentences(self, t2t_stream: AsyncGenerator[str, None], t2t_parts: List[str]) -> AsyncGenerator[str, None]:
+        '''Yield each sentence of t2t output once complete. Raw output is collected into t2t_parts.'''
+        sentences = SentenceBuffer(min_length=Config().response_stream_min_chars)
+        async for content in t2t_stream:
+            t2t_parts.append(content)
+            for sentence in sentences.feed(content):
+                yield sentence
+
+        remainder = sentences.flush()
+        if remainder: yield remainder
+
+    async def _respond_with_text(self, job_id: str, job_type: JobType, content_stream: AsyncGenerator[str, None], include_audio: bool):
+        '''Run generated text through the response pipeline graph, broadcasting results in order'''
+        graph = PipelineGraph(Config().response_graph)
+
+        with Tracer().span("response.graph", texts=0, audio_chunks=0) as span_attrs:
+            async for kind, chunk_out in graph.run(content_stream, include_audio=include_audio):
+                if kind == "text":
+                    span_attrs["texts"] += 1
+                    self.prompter.add_chat(self.prompter.character_name, chunk_out['content'])
+                    await self._handle_broadcast_event(job_id, job_type, chunk_out)
+                else:
+                    span_attrs["audio_chunks"] += 1
+                    # Compressed once here and shared by every client, the websocket server only frames it
+                    audio_bytes, codec = chunk_out['audio_bytes'], "pcm"
+                    if Config().audio_output_codec != "pcm":
+                        audio_bytes, codec = await BlockingExecutor().run(
+                            encode_audio, chunk_out['audio_bytes'], chunk_out['sr'], chunk_out['sw'], chunk_out['ch'], Config().audio_output_codec
+                        )
+                    
+                    # Broadcast results (only the audio data for now)
+                    await self._handle_broadcast_event(job_id, job_type, {
+                        "audio_bytes": audio_bytes,
+                        "sr": chunk_out['sr'],
+                        "sw": chunk_out['sw'],
+                        "ch": chunk_out['ch'],
+                        "codec": codec
+                    })
 
     # Context modification
     async def clear_context(
@@ -370,6 +637,58 @@ class JAIson(metaclass=Singleton):
         })
         await self._handle_broadcast_success(job_id, job_type)
         
+    async def append_conversation_context_text_batch(
+        self,
+        job_type: JobType,
+        batch: List[Tuple[str, Dict[str, Any]]]
+    ):
+        '''Add the lines of several queued text context jobs in one go. The first job that is still valid reports the batch'''
+        leader_id = batch[0][0]
+        metrics = Metrics()
+        
+        valid_ids, chats = list(), list()
+        for job_id, kwargs in batch:
+            queued_time = self.job_queued_time.pop(job_id, None)
+            if queued_time is not None and job_id != leader_id:
+                metrics.job_queue_wait_ms.observe((time.perf_counter()-queued_time)*1000, job_type=job_type.value)
+            
+            if job_id in self.job_skips:
+                await self._handle_broadcast_error(job_id, job_type, asyncio.CancelledError(self.job_skips[job_id]))
+                continue
+            try:
+                timestamp = kwargs.get("timestamp", None)
+                time_o = datetime.datetime.fromtimestamp(timestamp) if not isinstance(timestamp, datetime.datetime) else timestamp
+                assert kwargs.get("user", None) and kwargs.get("content", None)
+            except Exception as err:
+                await self._handle_broadcast_error(job_id, job_type, err)
+                continue
+            valid_ids.append(job_id)
+            chats.append((kwargs["user"], kwargs["content"], time_o))
+        
+        if len(chats) == 0: return
+        
+        # Jobs that already got their error above are finished, so never report the batch under them
+        batch_id = valid_ids[0]
+        try:
+            await self._handle_broadcast_start(batch_id, job_type, {"batch": valid_ids})
+            lines = self.prompter.add_chats(chats)
+            await self._handle_broadcast_event(batch_id, job_type, {
+                "batch": [{
+                    "job_id": job_id,
+                    "user": line_o.user,
+                    "timestamp": line_o.time.timestamp(),
+                    "content": line_o.message,
+                    "line": line_o.to_line()
+                } for job_id, line_o in zip(valid_ids, lines)]
+            })
+        except Exception as err:
+            logging.warning(f"Text context batch failed: {err}", exc_info=err)
+            for job_id in valid_ids:
+                await self._handle_broadcast_error(job_id, job_type, err)
+            return
+        for job_id in valid_ids:
+            await self._handle_broadcast_success(job_id, job_type)
+        
     async def append_conversation_context_audio(
         self,
         job_id: str,
@@ -536,7 +855,6 @@ class JAIson(metaclass=Singleton):
             op = self.op_manager.loose_load_operation(OpRoles(role), id)
             await op.start()
             async for chunk_out in op(payload):
-                if "audio_bytes" in chunk_out: chunk_out["audio_bytes"] = base64.b64encode(chunk_out['audio_bytes']).decode('utf-8')
                 await self._handle_broadcast_event(job_id, job_type, chunk_out)
             await op.close()
             
@@ -564,7 +882,7 @@ class JAIson(metaclass=Singleton):
             "job_id": job_id,
             "start": payload
         }
-        logging.debug("Broadcasting start ({}) {} {:.500}".format(job_id, job_type.value, str(to_broadcast)))
+        logging.debug("Broadcasting start (%s) %s %.500s", job_id, job_type.value, to_broadcast)
         await self.event_server.broadcast_event(job_type.value, to_broadcast)
     
     async def _handle_broadcast_event(self, job_id: str, job_type: JobType, payload: dict):
@@ -573,16 +891,18 @@ class JAIson(metaclass=Singleton):
             "finished": False,
             "result": payload
         }
-        logging.debug("Broadcasting event ({}) {} {:.500}".format(job_id, job_type.value, str(to_broadcast)))
+        logging.debug("Broadcasting event (%s) %s %.500s", job_id, job_type.value, to_broadcast)
         await self.event_server.broadcast_event(job_type.value, to_broadcast)
     
     async def _handle_broadcast_success(self, job_id: str, job_type: JobType):
+        Tracer().close_job_span(job_id)
         to_broadcast = {
             "job_id": job_id,
             "finished": True,
-            "success": True
+            "success": True,
+            "timeline": Tracer().timeline(job_id)
         }
-        logging.debug("Broadcasting success ({}) {} {}".format(job_id, job_type.value, str(to_broadcast)))
+        logging.debug("Broadcasting success (%s) %s %s", job_id, job_type.value, to_broadcast)
         await self.event_server.broadcast_event(job_type.value, to_broadcast)
         
     async def _handle_broadcast_error(self, job_id: str, job_type: JobType, err: Exception):
@@ -597,10 +917,15 @@ class JAIson(metaclass=Singleton):
         elif isinstance(err, CloseInactiveError): error_type = "operation_inactive"
         elif isinstance(err, UsedInactiveError): error_type = "operation_inactive"
         elif isinstance(err, UnknownField): error_type = "config_unknown_field"
+        elif isinstance(err, InvalidField): error_type = "config_invalid_field"
         elif isinstance(err, UnknownFile): error_type = "config_unknown_file"
+        elif isinstance(err, InvalidPipelineGraph): error_type = "pipeline_invalid_graph"
         elif isinstance(err, UnknownJobType): error_type = "job_unknown"
+        elif isinstance(err, JobExpired): error_type = "job_expired"
+        elif isinstance(err, JobSuperseded): error_type = "job_superseded"
         elif isinstance(err, asyncio.CancelledError): error_type = "job_cancelled"
         
+        Tracer().close_job_span(job_id, err)
         to_broadcast = {
             "job_id": job_id,
             "finished": True,
@@ -608,8 +933,9 @@ class JAIson(metaclass=Singleton):
             "result": {
                 "type": error_type,
                 "reason": str(err)
-            }
+            },
+            "timeline": Tracer().timeline(job_id)
         }
         
-        logging.debug("Broadcasting error ({}) {} {}".format(job_id, job_type.value, str(to_broadcast)))
+        logging.debug("Broadcasting error (%s) %s %s", job_id, job_type.value, to_broadcast)
         await self.event_server.broadcast_event(job_type.value, to_broadcast)
\ No newline at end of file
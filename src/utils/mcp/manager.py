@@ -17,6 +17,7 @@ from mcp.types import (
 from utils.prompter.message import RawMessage
 
 from utils.config import Config
+from utils.tracing import Tracer
 from utils.operations import OperationManager, OpRoles
 
 def parse_tool_result(result):
@@ -280,6 +281,12 @@ Below is a list of descriptions for all available tool:\n
         return prompt
             
     async def use(self, tooling_response: str):
+        with Tracer().span("mcp.use") as span_attrs:
+            results = await self._call_tools(tooling_response)
+            span_attrs["results"] = len(results)
+            return results
+        
+    async def _call_tools(self, tooling_response: str):
         tool_calls = tooling_response.split("\n")
         
         result_list = list()
@@ -0,0 +1,142 @@
+'''
+Process-wide metrics
+
+Counters, gauges and histograms keyed by label values, rendered in the
+Prometheus text exposition format for /api/metrics. Everything is kept in
+memory since the application started.
+'''
+
+import math
+from typing import Dict, Tuple, List, Any
+
+from utils.helpers.singleton import Singleton
+
+MS_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+COUNT_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+BYTES_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+def _format_value(value: float) -> str:
+    if value == math.inf: return "+Inf"
+    if float(value).is_integer(): return str(int(value))
+    return repr(float(value))
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(label_names: Tuple[str, ...], label_values: Tuple[str, ...], extra: str = None) -> str:
+    pairs = ['{}="{}"'.format(name, _escape(value)) for name, value in zip(label_names, label_values)]
+    if extra: pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class _Metric():
+    TYPE = None
+
+    def __init__(self, name: str, description: str, label_names: Tuple[str, ...] = ()):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+
+    def _label_values(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def render(self) -> List[str]:
+        return [
+            "# HELP {} {}".format(self.name, self.description),
+            "# TYPE {} {}".format(self.name, self.TYPE)
+        ] + self._render_samples()
+
+    def _render_samples(self) -> List[str]:
+        raise NotImplementedError
+
+class Counter(_Metric):
+    TYPE = "counter"
+
+    def __init__(self, name: str, description: str, label_names: Tuple[str, ...] = ()):
+        super().__init__(name, description, label_names)
+        self.values: Dict[Tuple[str, ...], float] = dict()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._label_values(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def _render_samples(self) -> List[str]:
+        return ["{}{} {}".format(self.name, _format_labels(self.label_names, key), _format_value(value)) for key, value in self.values.items()]
+
+class Gauge(Counter):
+    TYPE = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        self.values[self._label_values(labels)] = value
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def clear(self) -> None:
+        self.values.clear()
+
+class Histogram(_Metric):
+    TYPE = "histogram"
+
+    def __init__(self, name: str, description: str, label_names: Tuple[str, ...] = (), buckets: Tuple[float, ...] = MS_BUCKETS):
+        super().__init__(name, description, label_names)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self.values: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = dict() # labels to (bucket counts, [sum, count])
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._label_values(labels)
+        if key not in self.values: self.values[key] = ([0]*len(self.buckets), [0.0, 0])
+        bucket_counts, totals = self.values[key]
+        for idx, bound in enumerate(self.buckets):
+            if value <= bound:
+                bucket_counts[idx] += 1
+                break
+        totals[0] += value
+        totals[1] += 1
+
+    def _render_samples(self) -> List[str]:
+        lines = list()
+        for key, (bucket_counts, (total, count)) in self.values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative += bucket_count
+                le = 'le="{}"'.format(_format_value(bound))
+                lines.append("{}_bucket{} {}".format(self.name, _format_labels(self.label_names, key, le), cumulative))
+            lines.append("{}_sum{} {}".format(self.name, _format_labels(self.label_names, key), _format_value(total)))
+            lines.append("{}_count{} {}".format(self.name, _format_labels(self.label_names, key), count))
+        return lines
+
+class Metrics(metaclass=Singleton):
+    def __init__(self):
+        op_labels = ("role", "op_id")
+        self.op_first_chunk_ms = Histogram("jaison_operation_first_chunk_ms", "Time from calling an operation to its first result", op_labels)
+        self.op_duration_ms = Histogram("jaison_operation_duration_ms", "Time from calling an operation to its last result", op_labels)
+        self.op_chunks = Histogram("jaison_operation_chunks", "Results yielded per operation call", op_labels, COUNT_BUCKETS)
+        self.op_bytes_in = Histogram("jaison_operation_bytes_in", "Size of text and audio given to an operation call", op_labels, BYTES_BUCKETS)
+        self.op_bytes_out = Histogram("jaison_operation_bytes_out", "Size of text and audio yielded by an operation call", op_labels, BYTES_BUCKETS)
+        self.op_errors = Counter("jaison_operation_errors_total", "Operation calls that raised an error", op_labels)
+        self.op_running = Gauge("jaison_operation_running", "Operation calls currently generating", op_labels)
+        self.op_queued = Gauge("jaison_operation_queued", "Operation calls waiting for their concurrency limit", op_labels)
+        self.executor_queued = Gauge("jaison_blocking_executor_queued", "Blocking calls waiting for a free thread")
+
+        self.job_queue_wait_ms = Histogram("jaison_job_queue_wait_ms", "Time a job waited in the queue before running", ("job_type",))
+        self.job_queue_depth = Gauge("jaison_job_queue_depth", "Jobs waiting in the queue")
+        self.job_dropped = Counter("jaison_job_dropped_total", "Queued jobs dropped before running because they expired or were superseded", ("job_type", "reason"))
+
+        self.ws_connections = Gauge("jaison_websocket_connections", "Open websocket connections")
+        self.ws_events_dropped = Counter("jaison_websocket_events_dropped_total", "Events not sent to a websocket client that couldn't keep up", ("kind", "policy"))
+        self.ws_slow_disconnects = Counter("jaison_websocket_slow_disconnects_total", "Websocket clients disconnected for falling too far behind")
+
+    def render(self) -> str:
+        '''All metrics in Prometheus text format'''
+        lines = list()
+        for metric in vars(self).values():
+            if isinstance(metric, _Metric): lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+def chunk_size(chunk: Dict[str, Any]) -> int:
+    '''Bytes of text and audio in a chunk'''
+    size = 0
+    for value in chunk.values():
+        if isinstance(value, (bytes, bytearray)): size += len(value)
+        elif isinstance(value, str): size += len(value.encode('utf-8'))
+    return size
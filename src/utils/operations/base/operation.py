@@ -1,56 +1,171 @@
-from typing import Dict, Any, AsyncGenerator
+from typing import Dict, Any, AsyncGenerator, Callable
+import asyncio
+import threading
 import time
 import logging
 
+from utils.helpers.executor import BlockingExecutor
+from utils.metrics import Metrics, chunk_size
+
 from .error import StartActiveError, CloseInactiveError, UsedInactiveError
 
+class _DrainEnd:
+    '''Marks the end of a generation drained on another thread'''
+
 class Operation:
+    # Set True if _generate blocks (sync SDK calls, heavy compute) so it is run on the shared thread pool
+    BLOCKING = False
+    # Default number of generations of this operation allowed to run at once
+    MAX_CONCURRENCY = 1
+
     def __init__(self, op_type: str, op_id: str):
         self.op_type = op_type
         self.op_id = op_id
-        
+        self.op_role = op_type # Set by OperationManager when loaded for another role (MCP)
+
         self.active = False
-    
+
+        self.concurrency_limit: int = self.MAX_CONCURRENCY
+        self.semaphore: asyncio.Semaphore = None
+        self.queued: int = 0 # Calls waiting for their turn
+        self.running: int = 0 # Calls currently generating
+        self.generating: int = 0 # Calls that haven't finished yet, whether waiting or generating
+
     async def __call__(self, chunk_in: Dict[str, Any]) -> AsyncGenerator[Dict[str, Any], None]:
         '''Generates a stream of chunks similar to chunk_in but augmented with new data'''
         if not self.active: raise UsedInactiveError(self.op_type, self.op_id)
+        metrics = Metrics()
+        labels = {"role": self.op_role, "op_id": self.op_id}
         start_time = time.perf_counter()
-        
-        kwargs = await self._parse_chunk(chunk_in)
-        
-        async for chunk_out in self._generate(**kwargs):
-            # yield chunk_in | chunk_out
-            yield chunk_out
+        chunk_count, bytes_out = 0, 0
+
+        self.generating += 1
+        try:
+            kwargs = await self._parse_chunk(chunk_in)
+
+            stream = self._generate_blocking(kwargs) if self.BLOCKING else self._generate(**kwargs)
+            async for chunk_out in stream:
+                if chunk_count == 0: metrics.op_first_chunk_ms.observe((time.perf_counter()-start_time)*1000, **labels)
+                chunk_count += 1
+                bytes_out += chunk_size(chunk_out)
+                # yield chunk_in | chunk_out
+                yield chunk_out
+        except (asyncio.CancelledError, GeneratorExit):
+            # Caller stopped listening midway (job cancelled or interrupted), so stop the provider too
+            # Skipped when other calls are generating since providers can't tell them apart
+            if self.generating == 1: await self._safe_interrupt()
+            raise
+        except Exception:
+            metrics.op_errors.inc(**labels)
+            raise
+        finally:
+            self.generating -= 1
         end_time = time.perf_counter()
+
+        metrics.op_duration_ms.observe((end_time-start_time)*1000, **labels)
+        metrics.op_chunks.observe(chunk_count, **labels)
+        metrics.op_bytes_in.observe(chunk_size(chunk_in), **labels)
+        metrics.op_bytes_out.observe(bytes_out, **labels)
         logging.info("{} operation {} completed in {} ms".format(self.op_type, self.op_id, (end_time-start_time)*1000))
-    
-    
+
+    async def _generate_blocking(self, kwargs: Dict[str, Any]) -> AsyncGenerator[Dict[str, Any], None]:
+        '''Run _generate on the shared thread pool, yielding its chunks back on the event loop'''
+        loop = asyncio.get_running_loop()
+        out_queue = asyncio.Queue()
+        cancelled = threading.Event()
+
+        self.queued += 1
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.queued -= 1
+        self.running += 1
+
+        def release(future):
+            # Only free the slot once the thread is actually done, even if the caller stopped listening
+            self.running -= 1
+            self.semaphore.release()
+
+        try:
+            future = self._run_blocking(self._drain_generate, kwargs, loop, out_queue, cancelled)
+        except BaseException:
+            release(None)
+            raise
+        future.add_done_callback(release)
+
+        try:
+            while True:
+                chunk_out, err = await out_queue.get()
+                if isinstance(err, _DrainEnd): break
+                if err is not None: raise err
+                yield chunk_out
+        finally:
+            cancelled.set()
+
+    def _run_blocking(self, func: Callable, *args) -> asyncio.Future:
+        '''Run func(*args) where this operation's blocking code runs, the shared thread pool unless overriden'''
+        return BlockingExecutor().run(func, *args)
+
+    def _drain_generate(self, kwargs: Dict[str, Any], loop: asyncio.AbstractEventLoop, out_queue: asyncio.Queue, cancelled: threading.Event):
+        '''Runs on a pool thread with its own event loop'''
+        async def drain():
+            async for chunk_out in self._generate(**kwargs):
+                loop.call_soon_threadsafe(out_queue.put_nowait, (chunk_out, None))
+                if cancelled.is_set(): break
+
+        try:
+            asyncio.run(drain())
+        except BaseException as err:
+            loop.call_soon_threadsafe(out_queue.put_nowait, (None, err))
+        else:
+            loop.call_soon_threadsafe(out_queue.put_nowait, (None, _DrainEnd()))
+
+    async def _safe_interrupt(self) -> None:
+        try:
+            await self.interrupt()
+        except Exception as err:
+            logging.warning("Failed to interrupt {} operation {}: {}".format(self.op_type, self.op_id, err))
+
+    def get_execution_stats(self) -> Dict[str, Any]:
+        '''Returns how busy this operation is'''
+        return {
+            "blocking": self.BLOCKING,
+            "concurrency_limit": self.concurrency_limit,
+            "running": self.running,
+            "queued": self.queued
+        }
+
     ## TO BE OVERRIDEN ####
     async def start(self) -> None:
         '''General setup needed to start generated'''
         if self.active: raise StartActiveError(self.op_type, self.op_id)
         logging.info("Starting {} operation {}".format(self.op_type, self.op_id))
+        self.semaphore = asyncio.Semaphore(self.concurrency_limit)
         self.active = True
-    
+
     async def close(self) -> None:
         '''Clean up resources before unloading'''
         if not self.active: raise CloseInactiveError(self.op_type, self.op_id)
         logging.info("Closing {} operation {}".format(self.op_type, self.op_id))
         self.active = False
-    
+
+    async def interrupt(self) -> None:
+        '''Abort whatever the provider is still generating after the caller stopped listening'''
+        pass
+
     ## TO BE IMPLEMENTED ####
     async def configure(self, config_d: Dict[str, Any]):
         '''Configure and validate operation-specific configuration'''
         raise NotImplementedError
-    
+
     async def get_configuration(self) -> Dict[str, Any]:
         '''Returns values of configurable fields'''
         raise NotImplementedError
-    
+
     async def _parse_chunk(self, chunk_in: Dict[str, Any]) -> Dict[str, Any]:
         '''Extract information from input for use in _generate'''
         raise NotImplementedError
-    
+
     async def _generate(self, **kwargs) -> AsyncGenerator[Dict[str, Any], None]:
         '''Generate a output stream'''
         raise NotImplementedError
\ No newline at end of file
@@ -0,0 +1,79 @@
+'''
+Compiled filter chain
+
+Built once whenever the loaded filters of a role (or their configuration)
+change, and reused for every chunk after that. Filters that currently do
+nothing are left out, independent filters are grouped so they can run side
+by side, and chunks are dispatched through the groups iteratively instead of
+through one nested generator per filter.
+'''
+
+import asyncio
+from typing import Dict, List, Any, AsyncGenerator
+
+from .base import Operation
+
+class FilterChain():
+    def __init__(self, filter_list: List[Operation]):
+        self.groups: List[List[Operation]] = self._plan([op for op in filter_list if not op.is_noop()])
+
+    def _plan(self, filter_list: List[Operation]) -> List[List[Operation]]:
+        '''
+        Group filters by their dependencies on each other
+
+        A filter joins the group before it if it doesn't read any key written by that
+        group. Filters in a group all get the same chunk and can run side by side.
+        Filters that split chunks always get a group of their own.
+        '''
+        groups = list()
+        for op in filter_list:
+            if groups and not op.SPLITS and not any(grouped.SPLITS for grouped in groups[-1]):
+                group_writes = set().union(*(grouped.WRITES for grouped in groups[-1]))
+                if not (op.READS & group_writes):
+                    groups[-1].append(op)
+                    continue
+            groups.append([op])
+
+        return groups
+
+    async def __call__(self, chunk_in: Dict[str, Any]) -> AsyncGenerator[Dict[str, Any], None]:
+        '''Apply all filters to chunk_in, yielding final chunks in order'''
+        if not self.groups:
+            yield chunk_in
+            return
+
+        last_idx = len(self.groups)-1
+        stack = [(0, self._apply_group(0, chunk_in))]
+        while stack:
+            group_idx, stream = stack[-1]
+            try:
+                chunk_out = await stream.__anext__()
+            except StopAsyncIteration:
+                stack.pop()
+                continue
+
+            if group_idx == last_idx: yield chunk_out
+            else: stack.append((group_idx+1, self._apply_group(group_idx+1, chunk_out)))
+
+    def _apply_group(self, group_idx: int, chunk_in: Dict[str, Any]) -> AsyncGenerator[Dict[str, Any], None]:
+        group = self.groups[group_idx]
+        if len(group) == 1: return group[0](chunk_in)
+        return self._use_group(group, chunk_in)
+
+    async def _use_group(self, group: List[Operation], chunk_in: Dict[str, Any]) -> AsyncGenerator[Dict[str, Any], None]:
+        '''Run independent filters on the same chunk at once and merge their results'''
+        async def collect(op: Operation):
+            return [chunk_out async for chunk_out in op(chunk_in)]
+
+        results = await asyncio.gather(*(collect(op) for op in group))
+
+        # Declared writes override, anything else passed along is only kept if not set yet
+        merged = dict()
+        for op, chunks_out in zip(group, results):
+            if len(chunks_out) != 1:
+                raise Exception("Filter {} yielded {} chunks but must yield exactly 1 to run alongside other filters".format(op.op_id, len(chunks_out)))
+            for key, value in chunks_out[0].items():
+                if key in op.WRITES or key not in merged:
+                    merged[key] = value
+
+        yield merged
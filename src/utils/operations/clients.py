@@ -0,0 +1,124 @@
+'''
+Shared OpenAI clients
+
+Operations talking to the same OpenAI-compatible endpoint with the same
+credentials share one client, and with it one connection pool. A client is
+created (and warmed up so the TLS handshake is already done) the first time
+an operation acquires it, and closed once the last operation releases it.
+Warmup runs outside the lock in a task of its own, so acquiring clients for
+other endpoints (or releasing them) never waits on a slow endpoint. Operations
+acquiring the same client wait for its warmup to finish.
+'''
+
+import os
+import asyncio
+import logging
+import time
+from typing import Dict, Any, Tuple
+
+from utils.config import Config
+from utils.helpers.singleton import Singleton
+
+class _ClientEntry():
+    def __init__(self, base_url: str, client, http_client):
+        self.base_url = base_url
+        self.client = client
+        self.http_client = http_client
+        self.refs: int = 0
+        self.warmup: asyncio.Task = None # Still running warmup, awaited by every acquirer
+        self.warmup_ms: float = None
+        self.requests: int = 0
+
+class OpenAIClients(metaclass=Singleton):
+    def __init__(self):
+        self.entries: Dict[Tuple[str, str], _ClientEntry] = dict()
+        self.lock = asyncio.Lock()
+
+    @staticmethod
+    def _key(base_url: str) -> Tuple[str, str]:
+        return (base_url.rstrip("/"), os.getenv("OPENAI_API_KEY", ""))
+
+    async def acquire(self, base_url: str):
+        '''Get the shared AsyncOpenAI client for base_url, creating and warming it if needed'''
+        key = self._key(base_url)
+        async with self.lock:
+            entry = self.entries.get(key, None)
+            if entry is None:
+                entry = self._create(base_url)
+                self.entries[key] = entry
+                if Config().openai_warmup: entry.warmup = asyncio.ensure_future(self._warmup(entry))
+            entry.refs += 1
+        
+        if entry.warmup is not None and not entry.warmup.done():
+            try:
+                await asyncio.shield(entry.warmup) # Other acquirers still want it if this one is cancelled
+            except BaseException:
+                await self.release(entry.client)
+                raise
+        return entry.client
+
+    async def release(self, client) -> None:
+        '''Give back a client from acquire, closing it if nothing else uses it'''
+        async with self.lock:
+            for key, entry in self.entries.items():
+                if entry.client is client: break
+            else:
+                logging.warning("Released an OpenAI client that is not shared")
+                await client.close()
+                return
+
+            entry.refs -= 1
+            if entry.refs <= 0:
+                del self.entries[key]
+                if entry.warmup is not None: entry.warmup.cancel()
+                await entry.client.close()
+                logging.info("Closed shared OpenAI client for {}".format(entry.base_url))
+
+    def _create(self, base_url: str) -> _ClientEntry:
+        import httpx
+        from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+        entry = None
+        async def count_request(request):
+            entry.requests += 1
+
+        http_client = DefaultAsyncHttpxClient(
+            limits=httpx.Limits(
+                max_connections=100,
+                max_keepalive_connections=20,
+                keepalive_expiry=Config().openai_keepalive_expiry
+            ),
+            event_hooks={"request": [count_request]}
+        )
+        entry = _ClientEntry(base_url, AsyncOpenAI(base_url=base_url, http_client=http_client), http_client)
+        logging.info("Created shared OpenAI client for {}".format(base_url))
+        return entry
+
+    async def _warmup(self, entry: _ClientEntry) -> None:
+        '''Open a connection ahead of the first real request. Failures are only logged'''
+        start_time = time.perf_counter()
+        try:
+            await asyncio.wait_for(entry.client.models.list(), timeout=10)
+        except Exception as err:
+            logging.warning("Failed to warm up OpenAI client for {}: {}".format(entry.base_url, err))
+            return
+        entry.warmup_ms = (time.perf_counter()-start_time)*1000
+        logging.debug("Warmed up OpenAI client for {} in {} ms".format(entry.base_url, entry.warmup_ms))
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = list()
+        for entry in self.entries.values():
+            entry_stats = {
+                "base_url": entry.base_url,
+                "refs": entry.refs,
+                "warmup_ms": entry.warmup_ms,
+                "requests": entry.requests
+            }
+            try:
+                connections = entry.http_client._transport._pool.connections
+                entry_stats["connections"] = len(connections)
+                entry_stats["idle_connections"] = sum(1 for conn in connections if conn.is_idle())
+            except AttributeError:
+                pass # Transport doesn't expose its pool
+            stats.append(entry_stats)
+        return {"openai": stats}
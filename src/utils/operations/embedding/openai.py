@@ -1,8 +1,8 @@
-from openai import AsyncOpenAI
 import struct
 import base64
 
 from .base import EmbeddingOperation
+from ..clients import OpenAIClients
 
 class OpenAIEmbedding(EmbeddingOperation):
     def __init__(self):
@@ -15,11 +15,11 @@ class OpenAIEmbedding(EmbeddingOperation):
         
     async def start(self):
         await super().start()
-        self.client = AsyncOpenAI(base_url=self.base_url)
+        self.client = await OpenAIClients().acquire(self.base_url)
         
     async def close(self):
         await super().close()
-        await self.client.close()
+        await OpenAIClients().release(self.client)
         self.client = None
         
     async def configure(self, config_d):
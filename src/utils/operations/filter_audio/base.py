@@ -17,6 +17,12 @@ from typing import Dict, Any, AsyncGenerator
 from ..base import Operation
 
 class FilterAudioOperation(Operation):
+    # Chunk keys this filter reads and writes. Consecutive filters where none
+    # reads what another writes are run side by side on the same chunk.
+    READS = {"audio_bytes", "sr", "sw", "ch"}
+    WRITES = {"audio_bytes", "sr", "sw", "ch"}
+    SPLITS = False # True if more than one chunk may be yielded per input chunk
+    
     def __init__(self, op_id: str):
         super().__init__("FILTER_AUDIO", op_id)
         
@@ -51,6 +57,10 @@ class FilterAudioOperation(Operation):
             "ch": chunk_in["ch"]
         }
     
+    def is_noop(self) -> bool:
+        '''Whether the filter leaves chunks unchanged with its current configuration, so it can be skipped'''
+        return False
+    
     ## TO BE IMPLEMENTED ####
     async def configure(self, config_d: Dict[str, Any]):
         '''Configure and validate operation-specific configuration'''
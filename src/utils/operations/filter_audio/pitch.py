@@ -4,6 +4,8 @@ from utils.helpers.audio import pitch_audio
 from .base import FilterAudioOperation
 
 class PitchFilter(FilterAudioOperation):   
+    BLOCKING = True
+    
     def __init__(self):
         super().__init__("pitch")
         
@@ -11,8 +13,12 @@ class PitchFilter(FilterAudioOperation):
         
     async def configure(self, config_d):
         '''Configure and validate operation-specific configuration'''
-        if "pitch_amount" in config_d: self.pitch_amount = str(config_d["pitch_amount"])
+        if "pitch_amount" in config_d: self.pitch_amount = int(config_d["pitch_amount"])
                 
+    def is_noop(self):
+        '''Pitching by 0 returns the same audio'''
+        return self.pitch_amount == 0
+        
     async def get_configuration(self):
         '''Returns values of configurable fields'''
         return {
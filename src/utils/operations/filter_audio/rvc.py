@@ -1,13 +1,44 @@
+import os
 import wave
 from rvc.modules.vc.modules import VC
 import torch
 import fairseq
 
 from utils.config import Config
+from utils.helpers.executor import BlockingExecutor
+from utils.helpers.audio import working_wav
+from utils.helpers.process_pool import ProcessWorkerPool
 
 from .base import FilterAudioOperation
 
+def _load_vc(voice: str) -> VC:
+    torch.serialization.add_safe_globals([fairseq.data.dictionary.Dictionary])
+    vc = VC()
+    model_name = voice if voice.endswith('.pth') else f"{voice}.pth"
+    vc.get_vc(model_name)
+    return vc
+
+def _convert(vc: VC, working_file: str, audio_bytes: bytes, sr: int, sw: int, ch: int, params: dict):
+    with wave.open(working_file, 'wb') as f:
+        f.setframerate(sr)
+        f.setsampwidth(sw)
+        f.setnchannels(ch)
+        f.writeframes(audio_bytes)
+        
+    tgt_sr, audio_opt, times, _ = vc.vc_single(1, working_file, **params)
+    return audio_opt.tobytes(), tgt_sr
+
+def _worker_init(voice: str, working_dir: str):
+    # Each worker converts through its own file
+    return _load_vc(voice), os.path.join(working_dir, "rvc_worker_{}.wav".format(os.getpid()))
+
+def _worker_convert(state, audio_bytes, params: dict):
+    vc, working_file = state
+    ab, tgt_sr = _convert(vc, working_file, audio_bytes, params.pop("sr"), params.pop("sw"), params.pop("ch"), params)
+    return ab, {"sr": tgt_sr}
+
 class RVCFilter(FilterAudioOperation):
+    BLOCKING = True
     TARGET_SR = 16000
     TARGET_SW = 2
     TARGET_CH = 1
@@ -15,7 +46,9 @@ class RVCFilter(FilterAudioOperation):
     def __init__(self):
         super().__init__("rvc")
         self.vc = None
+        self.pool = None
         
+        self.workers: int = 0
         self.voice: str = None
         self.f0_up_key: int = 0
         self.f0_method: str = "rmvpe"
@@ -27,16 +60,27 @@ class RVCFilter(FilterAudioOperation):
         self.rms_mix_rate: float = 0
         self.protect: float = 0.5
         
-        torch.serialization.add_safe_globals([fairseq.data.dictionary.Dictionary])
-        
     async def start(self):
+        if self.workers > 0:
+            # Let consecutive chunks convert on separate workers
+            self.concurrency_limit = max(self.concurrency_limit, self.workers)
         await super().start()
-        self.vc = VC()
-        model_name = self.voice if self.voice.endswith('.pth') else f"{self.voice}.pth"
-        self.vc.get_vc(model_name)
+        if self.workers > 0:
+            self.pool = ProcessWorkerPool("rvc", self.workers, _worker_init, _worker_convert, (self.voice, Config().WORKING_DIR))
+            await BlockingExecutor().run(self.pool.start)
+        else:
+            self.vc = _load_vc(self.voice)
+            
+    async def close(self):
+        await super().close()
+        if self.pool:
+            await BlockingExecutor().run(self.pool.close)
+            self.pool = None
+        self.vc = None
     
     async def configure(self, config_d):
         '''Configure and validate operation-specific configuration'''
+        if "workers" in config_d: self.workers = int(config_d["workers"])
         if "voice" in config_d: self.voice = str(config_d["voice"])
         if "f0_up_key" in config_d: self.f0_up_key = int(config_d["f0_up_key"])
         if "f0_method" in config_d: self.f0_method = str(config_d["f0_method"])
@@ -48,11 +92,13 @@ class RVCFilter(FilterAudioOperation):
         if "rms_mix_rate" in config_d: self.rms_mix_rate = float(config_d["rms_mix_rate"])
         if "protect" in config_d: self.protect = float(config_d["protect"])
         
+        assert self.workers >= 0
         # TODO check assertions
         
     async def get_configuration(self):
         '''Returns values of configurable fields'''
         return {
+            "workers": self.workers,
             "voice": self.voice,
             "f0_up_key": self.f0_up_key,
             "f0_method": self.f0_method,
@@ -66,28 +112,28 @@ class RVCFilter(FilterAudioOperation):
         }
 
     async def _generate(self, audio_bytes: bytes = None, sr: int = None, sw: int = None, ch: int = None, **kwargs):
-        with wave.open(Config().ffmpeg_working_src, 'wb') as f:
-            f.setframerate(sr)
-            f.setsampwidth(sw)
-            f.setnchannels(ch)
-            f.writeframes(audio_bytes)
-            
-        tgt_sr, audio_opt, times, _ = self.vc.vc_single(
-            1,
-            Config().ffmpeg_working_src,
-            f0_up_key=self.f0_up_key,
-            f0_method=self.f0_method,
-            f0_file=self.f0_file,
-            index_file=self.index_file,
-            index_rate=self.index_rate,
-            filter_radius=self.filter_radius,
-            resample_sr=self.resample_sr,
-            rms_mix_rate=self.rms_mix_rate,
-            protect=self.protect,
-        )
+        params = {
+            "f0_up_key": self.f0_up_key,
+            "f0_method": self.f0_method,
+            "f0_file": self.f0_file,
+            "index_file": self.index_file,
+            "index_rate": self.index_rate,
+            "filter_radius": self.filter_radius,
+            "resample_sr": self.resample_sr,
+            "rms_mix_rate": self.rms_mix_rate,
+            "protect": self.protect,
+        }
+        
+        if self.pool:
+            ab, meta = self.pool.run(audio_bytes, params | {"sr": sr, "sw": sw, "ch": ch})
+            tgt_sr = meta["sr"]
+        else:
+            # Calls may run at once with concurrency above 1, so each converts through its own file
+            with working_wav() as working_file:
+                ab, tgt_sr = _convert(self.vc, working_file, audio_bytes, sr, sw, ch, params)
         
         yield {
-            "audio_bytes": audio_opt.tobytes(),
+            "audio_bytes": ab,
             "sr": tgt_sr,
             "sw": self.TARGET_SW,
             "ch": self.TARGET_CH
@@ -11,6 +11,12 @@ from typing import Dict, Any, AsyncGenerator
 from ..base import Operation
 
 class FilterTextOperation(Operation):
+    # Chunk keys this filter reads and writes. Consecutive filters where none
+    # reads what another writes are run side by side on the same chunk.
+    READS = {"content"}
+    WRITES = {"content"}
+    SPLITS = False # True if more than one chunk may be yielded per input chunk
+    
     def __init__(self, op_id: str):
         super().__init__("FILTER_TEXT", op_id)
         
@@ -33,6 +39,10 @@ class FilterTextOperation(Operation):
             "content": chunk_in["content"]
         }
     
+    def is_noop(self) -> bool:
+        '''Whether the filter leaves chunks unchanged with its current configuration, so it can be skipped'''
+        return False
+    
     ## TO BE IMPLEMENTED ####
     async def configure(self, config_d: Dict[str, Any]):
         '''Configure and validate operation-specific configuration'''
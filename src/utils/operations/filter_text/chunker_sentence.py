@@ -5,6 +5,9 @@ from utils.config import Config
 from .base import FilterTextOperation
 
 class SentenceChunkerFilter(FilterTextOperation):
+    BLOCKING = True
+    SPLITS = True
+    
     def __init__(self):
         super().__init__("chunker_sentence")
         self.nlp = None
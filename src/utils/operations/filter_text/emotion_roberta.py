@@ -5,6 +5,9 @@ import torch
 from .base import FilterTextOperation
 
 class RobertaEmotionFilter(FilterTextOperation):
+    BLOCKING = True
+    WRITES = {"emotion"}
+    
     def __init__(self):
         super().__init__("emotion_roberta")
         self.classifier = None
@@ -3,7 +3,9 @@ import torch
 from .base import FilterTextOperation
 
 class KoalaModerationFilter(FilterTextOperation):
+    BLOCKING = True
     GOOD_LABEL = "OK"
+    WRITES = {"content", "filtered", "original_content"}
     
     def __init__(self):
         super().__init__("mod_koala")
@@ -3,7 +3,11 @@ from typing import Dict, List, AsyncGenerator, Any
 
 from .error import UnknownOpType, UnknownOpRole, UnknownOpID, DuplicateFilter, OperationUnloaded
 from .base import Operation
+from .chain import FilterChain
+from .clients import OpenAIClients
 from utils.helpers.singleton import Singleton
+from utils.helpers.executor import BlockingExecutor
+from utils.tracing import Tracer
 from utils.config import Config
 
 class OpTypes(Enum):
@@ -140,6 +144,10 @@ class OperationManager(metaclass=Singleton):
         self.filter_audio = list()
         self.filter_text = list()
         self.embedding = None
+        
+        # Rebuilt whenever the filters they're made from change
+        self.filter_audio_chain = FilterChain(self.filter_audio)
+        self.filter_text_chain = FilterChain(self.filter_text)
 
     def get_operation(self, op_role: OpRoles) -> Operation:
         match op_role:
@@ -171,6 +179,29 @@ class OperationManager(metaclass=Singleton):
             "filter_text": self.get_operation(OpRoles.FILTER_TEXT),
             "embedding": self.get_operation(OpRoles.EMBEDDING),
         }
+    
+    def get_execution_stats(self) -> Dict[str, Any]:
+        '''Get how busy each loaded operation, the shared blocking executor and shared clients are'''
+        op_stats = dict()
+        for role, op in self.get_operation_all().items():
+            if isinstance(op, list):
+                op_stats[role] = {filter_op.op_id: filter_op.get_execution_stats() for filter_op in op}
+            elif op is not None:
+                op_stats[role] = {op.op_id: op.get_execution_stats()}
+        
+        return {
+            "executor": BlockingExecutor().get_stats(),
+            "clients": OpenAIClients().get_stats(),
+            "operations": op_stats
+        }
+    
+    def _rebuild_filter_chain(self, op_role: OpRoles) -> None:
+        '''Recompile the chain of a filter role after its filters were loaded, unloaded or configured'''
+        match op_role:
+            case OpRoles.FILTER_AUDIO:
+                self.filter_audio_chain = FilterChain(self.filter_audio)
+            case OpRoles.FILTER_TEXT:
+                self.filter_text_chain = FilterChain(self.filter_text)
         
     async def get_configuration(
         self,
@@ -242,6 +273,10 @@ class OperationManager(metaclass=Singleton):
                 if op.op_id == op_id: raise DuplicateFilter("FILTER_TEXT", op_id)
                 
         new_op = load_op(role_to_type(op_role), op_id)
+        new_op.op_role = op_role.value
+        if "concurrency" in op_details:
+            new_op.concurrency_limit = int(op_details["concurrency"])
+            assert new_op.concurrency_limit >= 1
         await new_op.configure(op_details)
         await new_op.start()
         
@@ -260,8 +295,10 @@ class OperationManager(metaclass=Singleton):
                 self.tts = new_op
             case OpRoles.FILTER_AUDIO:
                 self.filter_audio.append(new_op)
+                self._rebuild_filter_chain(op_role)
             case OpRoles.FILTER_TEXT:
                 self.filter_text.append(new_op)
+                self._rebuild_filter_chain(op_role)
             case OpRoles.EMBEDDING:
                 if self.embedding: await self.embedding.close()
                 self.embedding = new_op
@@ -320,6 +357,7 @@ class OperationManager(metaclass=Singleton):
                     if op.op_id == op_id:
                         await op.close()
                         self.filter_audio.remove(op)
+                        self._rebuild_filter_chain(op_role)
                         return
                 raise OperationUnloaded("FILTER_AUDIO", op_id=op_id)
             case OpRoles.FILTER_TEXT:
@@ -327,6 +365,7 @@ class OperationManager(metaclass=Singleton):
                     if op.op_id == op_id:
                         await op.close()
                         self.filter_text.remove(op)
+                        self._rebuild_filter_chain(op_role)
                         return
                 raise OperationUnloaded("FILTER_TEXT", op_id=op_id)
             case OpRoles.EMBEDDING:
@@ -357,9 +396,11 @@ class OperationManager(metaclass=Singleton):
         for op in self.filter_audio:
             await op.close()
         self.filter_audio.clear()
+        self._rebuild_filter_chain(OpRoles.FILTER_AUDIO)
         for op in self.filter_text:
             await op.close()
         self.filter_text.clear()
+        self._rebuild_filter_chain(OpRoles.FILTER_TEXT)
         if self.embedding:
             await self.embedding.close()
             self.embedding = None
@@ -404,14 +445,18 @@ class OperationManager(metaclass=Singleton):
                 
                 for op in self.filter_audio:
                     if op.op_id == op_id:
-                        return await op.configure(config_d)
+                        await op.configure(config_d)
+                        self._rebuild_filter_chain(op_role)
+                        return
                 raise OperationUnloaded("FILTER_AUDIO", op_id=op_id)
             case OpRoles.FILTER_TEXT:
                 assert op_id is not None
                 
                 for op in self.filter_text:
                     if op.op_id == op_id:
-                        return await op.configure(config_d)
+                        await op.configure(config_d)
+                        self._rebuild_filter_chain(op_role)
+                        return
                 raise OperationUnloaded("FILTER_TEXT", op_id=op_id)
             case OpRoles.EMBEDDING:
                 if not self.embedding:
@@ -424,16 +469,6 @@ class OperationManager(metaclass=Singleton):
                 # Should never get here if op_role is indeed OpRoles
                 raise UnknownOpRole(op_role)
         
-    async def _use_filter(self, filter_list: List[Operation], filter_idx: int, chunk_in: Dict[str, Any]):
-        if filter_idx == len(filter_list): yield chunk_in
-        elif filter_idx < len(filter_list)-1: # Not last filter
-            async for result_chunk in filter_list[filter_idx](chunk_in):
-                async for chunk_out in self._use_filter(filter_list, filter_idx+1, result_chunk):
-                    yield chunk_out
-        else: # Is last filter
-            async for chunk_out in filter_list[filter_idx](chunk_in):
-                yield chunk_out
-            
     def use_operation(
         self,
         op_role: OpRoles,
@@ -441,6 +476,15 @@ class OperationManager(metaclass=Singleton):
         op_id: str = None
     ) -> AsyncGenerator[Dict[str, Any], None]:
         '''Use an operation that has already been loaded prior'''
+        stream = self._select_stream(op_role, chunk_in, op_id=op_id)
+        return Tracer().traced("operation.{}".format(op_role.value), stream, op_id=op_id)
+        
+    def _select_stream(
+        self,
+        op_role: OpRoles,
+        chunk_in: Dict[str, Any],
+        op_id: str = None
+    ) -> AsyncGenerator[Dict[str, Any], None]:
         match op_role:
             case OpRoles.STT:
                 if not self.stt:
@@ -477,7 +521,7 @@ class OperationManager(metaclass=Singleton):
                             return op(chunk_in)
                     raise OperationUnloaded("FILTER_AUDIO", op_id=op_id)
                 else:
-                    return self._use_filter(self.filter_audio, 0, chunk_in)
+                    return self.filter_audio_chain(chunk_in)
             case OpRoles.FILTER_TEXT:
                 if op_id:
                     for op in self.filter_text:
@@ -485,7 +529,7 @@ class OperationManager(metaclass=Singleton):
                             return op(chunk_in)
                     raise OperationUnloaded("FILTER_TEXT", op_id=op_id)
                 else:
-                    return self._use_filter(self.filter_text, 0, chunk_in)
+                    return self.filter_text_chain(chunk_in)
             case OpRoles.EMBEDDING:
                 if not self.embedding:
                     raise OperationUnloaded("EMBEDDING")
@@ -7,6 +7,8 @@ from fish_audio_sdk import Session, ASRRequest
 from .base import STTOperation
 
 class FishSTT(STTOperation):
+    BLOCKING = True
+    
     def __init__(self):
         super().__init__("fish")
         self.session = None
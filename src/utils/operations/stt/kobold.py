@@ -1,6 +1,5 @@
 from io import BytesIO
 import wave
-import requests
 import base64
 
 from utils.config import Config
@@ -13,7 +12,7 @@ class KoboldSTT(STTOperation):
     
     def __init__(self):
         super().__init__("kobold")
-        self.uri = None
+        self.kobold = None
         
         self.suppress_non_speech: bool = True
         self.langcode: str = "en"
@@ -22,7 +21,7 @@ class KoboldSTT(STTOperation):
         '''General setup needed to start generated'''
         await super().start()
         await ProcessManager().link(self.KOBOLD_LINK_ID, ProcessType.KOBOLD)
-        self.uri = "http://127.0.0.1:{}".format(ProcessManager().get_process(ProcessType.KOBOLD).port)
+        self.kobold = ProcessManager().get_process(ProcessType.KOBOLD)
     
     async def close(self) -> None:
         '''Clean up resources before unloading'''
@@ -53,8 +52,8 @@ class KoboldSTT(STTOperation):
             f.writeframes(audio_bytes)
         audio_data.seek(0)
 
-        response = requests.post(
-            "{}/api/extra/transcribe".format(self.uri), 
+        response = await self.kobold.client.post(
+            "/api/extra/transcribe", 
             json={
                 "prompt": prompt,
                 "suppress_non_speech": self.suppress_non_speech,
@@ -67,4 +66,4 @@ class KoboldSTT(STTOperation):
             result = response.json()['text']
             yield {"transcription": result}
         else:
-            raise Exception(f"Failed to get STT result: {response.status_code} {response.reason}")
\ No newline at end of file
+            raise Exception(f"Failed to get STT result: {response.status_code} {response.reason_phrase}")
\ No newline at end of file
@@ -1,10 +1,10 @@
 import wave
-from openai import AsyncOpenAI
 from pathlib import Path
 
-from utils.config import Config
+from utils.helpers.audio import working_wav
 
 from .base import STTOperation
+from ..clients import OpenAIClients
 
 class OpenAISTT(STTOperation):
     def __init__(self):
@@ -18,12 +18,12 @@ class OpenAISTT(STTOperation):
     async def start(self) -> None:
         '''General setup needed to start generated'''
         await super().start()
-        self.client = AsyncOpenAI(base_url=self.base_url)
+        self.client = await OpenAIClients().acquire(self.base_url)
     
     async def close(self) -> None:
         '''Clean up resources before unloading'''
         await super().close()
-        self.client.close()
+        await OpenAIClients().release(self.client)
         self.client = None
             
     async def configure(self, config_d):
@@ -46,18 +46,19 @@ class OpenAISTT(STTOperation):
 
     async def _generate(self, prompt: str = None,  audio_bytes: bytes = None, sr: int = None, sw: int = None, ch: int = None, **kwargs):
         '''Generate a output stream'''
-        with wave.open(Config().stt_working_src, 'w') as f:
-            f.setframerate(sr)
-            f.setsampwidth(sw)
-            f.setnchannels(ch)
-            f.writeframes(audio_bytes)
+        with working_wav() as working_file:
+            with wave.open(working_file, 'w') as f:
+                f.setframerate(sr)
+                f.setsampwidth(sw)
+                f.setnchannels(ch)
+                f.writeframes(audio_bytes)
 
-        transcription = await self.client.audio.transcriptions.create(
-            file=Path(Config().stt_working_src),
-            model=self.model,
-            response_format="text",
-            language=self.language,
-            prompt=prompt
-        )
+            transcription = await self.client.audio.transcriptions.create(
+                file=Path(working_file),
+                model=self.model,
+                response_format="text",
+                language=self.language,
+                prompt=prompt
+            )
         
         yield {"transcription": transcription}
\ No newline at end of file
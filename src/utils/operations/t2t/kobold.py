@@ -1,4 +1,4 @@
-import requests
+import json
 
 from utils.processes import ProcessManager, ProcessType
 
@@ -11,7 +11,7 @@ class KoboldT2T(T2TOperation):
     
     def __init__(self):
         super().__init__("kobold")
-        self.uri = None
+        self.kobold = None
         
         self.max_context_length: int = 2048
         self.max_length: int = 100
@@ -29,13 +29,18 @@ class KoboldT2T(T2TOperation):
         '''General setup needed to start generated'''
         await super().start()
         await ProcessManager().link(self.KOBOLD_LINK_ID, ProcessType.KOBOLD)
-        self.uri = "http://127.0.0.1:{}".format(ProcessManager().get_process(ProcessType.KOBOLD).port)
+        self.kobold = ProcessManager().get_process(ProcessType.KOBOLD)
     
     async def close(self) -> None:
         '''Clean up resources before unloading'''
         await super().close()
         await ProcessManager().unlink(self.KOBOLD_LINK_ID, ProcessType.KOBOLD)
     
+    async def interrupt(self) -> None:
+        '''Abort whatever the provider is still generating after the caller stopped listening'''
+        # Closing the stream doesn't stop KoboldCPP generating, so ask it to
+        await self.kobold.client.post("/api/extra/abort", json={}, timeout=5.0)
+    
     async def configure(self, config_d):
         '''Configure and validate operation-specific configuration'''
         if "max_context_length" in config_d: self.max_context_length = config_d["max_context_length"]
@@ -89,28 +94,35 @@ class KoboldT2T(T2TOperation):
                 next_hist = { "role": "user", "content": msg.to_line() }
             history.append(next_hist)
 
-        response = requests.post(
-            "{}/v1/chat/completions".format(self.uri), 
-            json={
-                "model": "kcpp",
-                "messages": history,
-                "max_context_length": self.max_context_length,
-                "max_length": self.max_length,
-                "quiet": True,
-                "rep_pen": self.rep_pen,
-                "rep_pen_range": self.rep_pen_range,
-                "rep_pen_slope": self.rep_pen_slope,
-                "temperature": self.temperature,
-                "tfs": self.tfs,
-                "top_a": self.top_a,
-                "top_k": self.top_k,
-                "top_p": self.top_p,
-                "typical": self.typical
-            },
-        )
+        request = {
+            "model": "kcpp",
+            "messages": history,
+            "stream": True,
+            "max_context_length": self.max_context_length,
+            "max_length": self.max_length,
+            "quiet": True,
+            "rep_pen": self.rep_pen,
+            "rep_pen_range": self.rep_pen_range,
+            "rep_pen_slope": self.rep_pen_slope,
+            "temperature": self.temperature,
+            "tfs": self.tfs,
+            "top_a": self.top_a,
+            "top_k": self.top_k,
+            "top_p": self.top_p,
+            "typical": self.typical
+        }
+
+        async with self.kobold.client.stream("POST", "/v1/chat/completions", json=request) as response:
+            if response.status_code != 200:
+                raise Exception(f"Failed to get T2T result: {response.status_code} {response.reason_phrase}")
 
-        if response.status_code == 200:
-            result = response.json()['choices'][0]['message']['content']
-            yield {"content": result}
-        else:
-            raise Exception(f"Failed to get T2T result: {response.status_code} {response.reason}")
\ No newline at end of file
+            # Server-sent events, one completion chunk per data line
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"): continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]": break
+                
+                choices = json.loads(data).get("choices", None)
+                if not choices: continue
+                content_chunk = choices[0].get("delta", {}).get("content", None) or ""
+                if content_chunk: yield {"content": content_chunk}
\ No newline at end of file
@@ -1,6 +1,5 @@
-from openai import AsyncOpenAI
-
 from .base import T2TOperation
+from ..clients import OpenAIClients
 from utils.prompter.message import ChatMessage
 from utils.prompter import Prompter
 
@@ -18,11 +17,11 @@ class OpenAIT2T(T2TOperation):
         
     async def start(self):
         await super().start()
-        self.client = AsyncOpenAI(base_url=self.base_url)
+        self.client = await OpenAIClients().acquire(self.base_url)
         
     async def close(self):
         await super().close()
-        await self.client.close()
+        await OpenAIClients().release(self.client)
         self.client = None
         
     async def configure(self, config_d):
@@ -74,7 +73,9 @@ class OpenAIT2T(T2TOperation):
         )
 
         full_response = ""
-        async for chunk in stream:
-            content_chunk = chunk.choices[0].delta.content or ""
-            full_response += content_chunk
-            yield {"content": content_chunk}
+        # Closing the response when the caller stops listening is what stops the provider generating
+        async with stream:
+            async for chunk in stream:
+                content_chunk = chunk.choices[0].delta.content or ""
+                full_response += content_chunk
+                yield {"content": content_chunk}
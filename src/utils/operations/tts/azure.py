@@ -8,6 +8,8 @@ from utils.config import Config
 from .base import TTSOperation
 
 class AzureTTS(TTSOperation):
+    BLOCKING = True
+    
     def __init__(self):
         super().__init__("azure")
         self.client = None
@@ -42,6 +44,11 @@ class AzureTTS(TTSOperation):
             "voice": self.voice
         }
 
+    async def interrupt(self) -> None:
+        '''Abort whatever the provider is still generating after the caller stopped listening'''
+        # Makes the pending speak_text_async().get() return early on its pool thread
+        self.speech_synthesizer.stop_speaking_async()
+
     async def _generate(self, content: str = None, **kwargs):
         '''Generate a output stream'''
         # create request with TextStream input type
@@ -1,4 +1,3 @@
-import requests
 from io import BytesIO
 import wave
 
@@ -12,7 +11,7 @@ class KoboldTTS(TTSOperation):
     
     def __init__(self):
         super().__init__("kobold")
-        self.uri = None
+        self.kobold = None
         
         self.voice = "kobo"
         
@@ -20,7 +19,7 @@ class KoboldTTS(TTSOperation):
         '''General setup needed to start generated'''
         await super().start()
         await ProcessManager().link(self.KOBOLD_LINK_ID, ProcessType.KOBOLD)
-        self.uri = "http://127.0.0.1:{}".format(ProcessManager().get_process(ProcessType.KOBOLD).port)
+        self.kobold = ProcessManager().get_process(ProcessType.KOBOLD)
     
     async def close(self) -> None:
         '''Clean up resources before unloading'''
@@ -40,8 +39,8 @@ class KoboldTTS(TTSOperation):
         }
 
     async def _generate(self, content: str = None, **kwargs):
-        response = requests.post(
-            "{}/api/extra/tts".format(self.uri), 
+        response = await self.kobold.client.post(
+            "/api/extra/tts", 
             json={
                 "input": content,
                 "voice": self.voice,
@@ -55,4 +54,4 @@ class KoboldTTS(TTSOperation):
             with wave.open(audio, 'r') as f:
                 yield {"audio_bytes": f.readframes(f.getnframes()), "sr": f.getframerate(), "sw": f.getsampwidth(), "ch": f.getnchannels()}
         else:
-            raise Exception(f"Failed to get T2T result: {response.status_code} {response.reason}")
\ No newline at end of file
+            raise Exception(f"Failed to get T2T result: {response.status_code} {response.reason_phrase}")
\ No newline at end of file
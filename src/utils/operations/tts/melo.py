@@ -7,10 +7,39 @@ import torch
 import soundfile
 
 from utils.config import Config
+from utils.helpers.executor import BlockingExecutor
+from utils.helpers.process_pool import ProcessWorkerPool
 
 from .base import TTSOperation
 
+def _load_model(language: str, device: str, config_filepath: str, model_filepath: str) -> TTS:
+    return TTS(
+        language=language,
+        device=device,
+        config_path=config_filepath,
+        ckpt_path=model_filepath
+    )
+
+def _synthesize(model: TTS, content: str, speaker_id: str, sample_rate: int, params: dict) -> bytes:
+    ab_np = model.tts_to_file(
+        content,
+        model.hps.data.spk2id[speaker_id],
+        # output_path="output/temp/melo_out.wav",
+        quiet=True,
+        **params
+    )
+    ab = torch.from_numpy(ab_np).float()
+    audio_buffer = BytesIO()
+    soundfile.write(audio_buffer, ab, sample_rate, format='WAV', subtype='PCM_16')
+    audio_buffer.seek(0)
+    with wave.open(audio_buffer, 'r') as f:
+        return f.readframes(f.getnframes())
+
+def _worker_synthesize(model: TTS, data, params: dict):
+    return _synthesize(model, params.pop("content"), params.pop("speaker_id"), params.pop("sample_rate"), params), dict()
+
 class MeloTTS(TTSOperation):
+    BLOCKING = True
     SAMPLE_RATE = 44100
     SAMPLE_WIDTH = 2
     CHANNELS = 1
@@ -18,8 +47,10 @@ class MeloTTS(TTSOperation):
     def __init__(self):
         super().__init__("melo")
         self.model = None
+        self.pool = None
         self.speaker_ids = dict()
         
+        self.workers: int = 0
         self.config_filepath = None
         self.model_filepath = None
         self.speaker_id = None
@@ -33,24 +64,31 @@ class MeloTTS(TTSOperation):
         
     async def start(self) -> None:
         '''General setup needed to start generated'''
+        if self.workers > 0:
+            # Let consecutive sentences synthesize on separate workers
+            self.concurrency_limit = max(self.concurrency_limit, self.workers)
         await super().start()
-        self.model = TTS(
-            language=self.language,
-            device=self.device,
-            config_path=self.config_filepath,
-            ckpt_path=self.model_filepath
-        )
-        self.speaker_ids = self.model.hps.data.spk2id
+        model_args = (self.language, self.device, self.config_filepath, self.model_filepath)
+        if self.workers > 0:
+            self.pool = ProcessWorkerPool("melo", self.workers, _load_model, _worker_synthesize, model_args)
+            await BlockingExecutor().run(self.pool.start)
+        else:
+            self.model = _load_model(*model_args)
+            self.speaker_ids = self.model.hps.data.spk2id
     
     async def close(self) -> None:
         '''Clean up resources before unloading'''
         await super().close()
+        if self.pool:
+            await BlockingExecutor().run(self.pool.close)
+            self.pool = None
         del self.model
         self.model = None
         self.speaker_ids = dict()
 
     async def configure(self, config_d):
         '''Configure and validate operation-specific configuration'''
+        if "workers" in config_d: self.workers = int(config_d["workers"])
         if config_d.get("config_filepath", None): self.config_filepath = str(config_d['config_filepath'])
         if config_d.get("model_filepath", None): self.model_filepath = str(config_d['model_filepath'])
         if "speaker_id" in config_d: self.speaker_id = str(config_d['speaker_id'])
@@ -69,6 +107,7 @@ class MeloTTS(TTSOperation):
         assert self.noise_scale < 1.25 and self.noise_scale >= 0
         assert self.noise_scale_w < 1.25 and self.noise_scale_w >= 0
         assert self.speed > 0
+        assert self.workers >= 0
  
     async def get_configuration(self):
         '''Returns values of configurable fields'''
@@ -77,29 +116,27 @@ class MeloTTS(TTSOperation):
             "model_filepath": self.model_filepath,
             "speaker_id": self.speaker_id,
             "device": self.device,
-            "language": self.language
+            "language": self.language,
+            "workers": self.workers
         }
 
     async def _generate(self, content: str = None, **kwargs):
         '''Generate a output stream'''
-        ab_np = self.model.tts_to_file(
-            content,
-            self.speaker_ids[self.speaker_id],
-            # output_path="output/temp/melo_out.wav",
-            sdp_ratio=self.sdp_ratio,
-            noise_scale=self.noise_scale,
-            noise_scale_w=self.noise_scale_w,
-            speed=self.speed,
-            quiet=True
-        )
-        ab = torch.from_numpy(ab_np).float()
-        audio_buffer = BytesIO()
-        soundfile.write(audio_buffer, ab, self.SAMPLE_RATE, format='WAV', subtype='PCM_16')
-        audio_buffer.seek(0)
-        with wave.open(audio_buffer, 'r') as f:
-            yield {
-                "audio_bytes": f.readframes(f.getnframes()),
-                "sr": self.SAMPLE_RATE,
-                "sw": self.SAMPLE_WIDTH,
-                "ch": self.CHANNELS
-            }
\ No newline at end of file
+        params = {
+            "sdp_ratio": self.sdp_ratio,
+            "noise_scale": self.noise_scale,
+            "noise_scale_w": self.noise_scale_w,
+            "speed": self.speed
+        }
+        
+        if self.pool:
+            ab, _ = self.pool.run(params=params | {"content": content, "speaker_id": self.speaker_id, "sample_rate": self.SAMPLE_RATE})
+        else:
+            ab = _synthesize(self.model, content, self.speaker_id, self.SAMPLE_RATE, params)
+        
+        yield {
+            "audio_bytes": ab,
+            "sr": self.SAMPLE_RATE,
+            "sw": self.SAMPLE_WIDTH,
+            "ch": self.CHANNELS
+        }
\ No newline at end of file
@@ -1,10 +1,10 @@
 import wave
 from io import BytesIO
-from openai import AsyncOpenAI
 
 from utils.config import Config
 
 from .base import TTSOperation
+from ..clients import OpenAIClients
 
 class OpenAITTS(TTSOperation):
     def __init__(self):
@@ -18,12 +18,12 @@ class OpenAITTS(TTSOperation):
     async def start(self) -> None:
         '''General setup needed to start generated'''
         await super().start()
-        self.client = AsyncOpenAI(base_url=self.base_url)
+        self.client = await OpenAIClients().acquire(self.base_url)
     
     async def close(self) -> None:
         '''Clean up resources before unloading'''
         await super().close()
-        await self.client.close()
+        await OpenAIClients().release(self.client)
         self.client = None
 
     async def configure(self, config_d):
@@ -6,9 +6,11 @@ OS can be found using get_available_voices
 '''
 
 import logging
+import asyncio
 import pyttsx3
 import wave
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 from utils.helpers.path import portable_path
 from utils.config import Config
@@ -16,9 +18,12 @@ from utils.config import Config
 from .base import TTSOperation
 
 class PyttsTTS(TTSOperation):
+    BLOCKING = True
+    
     def __init__(self):
         super().__init__("pytts")
         self.engine = None
+        self.thread: ThreadPoolExecutor = None
         
         self.voice: str = None
         self.gender: str = 'female'
@@ -27,6 +32,12 @@ class PyttsTTS(TTSOperation):
     async def start(self):
         await super().start()
         
+        # pyttsx3 engines only work on the thread that made them, so this operation gets a thread of its own
+        # instead of the shared pool. That also keeps calls from using the working file at the same time
+        self.thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix="jaison-pytts")
+        await self._run_blocking(self._start_engine)
+
+    def _start_engine(self):
         self.engine = pyttsx3.init()
         voices = self.engine.getProperty('voices')
         logging.info("Operation {}: Available voices are: {}".format(self.op_id, list(map(lambda x: x.id, voices))))
@@ -36,8 +47,13 @@ class PyttsTTS(TTSOperation):
 
     async def close(self):
         await super().close()
-        self.engine.stop()
+        await self._run_blocking(self.engine.stop)
         self.engine = None
+        self.thread.shutdown(wait=False)
+        self.thread = None
+
+    def _run_blocking(self, func, *args) -> asyncio.Future:
+        return asyncio.get_running_loop().run_in_executor(self.thread, func, *args)
 
     async def configure(self, config_d):
         '''Configure and validate operation-specific configuration'''
@@ -0,0 +1,2 @@
+from .graph import PipelineGraph
+from .error import InvalidPipelineGraph
\ No newline at end of file
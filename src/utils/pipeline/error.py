@@ -0,0 +1,3 @@
+class InvalidPipelineGraph(Exception):
+    def __init__(self, reason: str):
+        super().__init__("Invalid response pipeline graph: {}".format(reason))
\ No newline at end of file
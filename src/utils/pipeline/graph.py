@@ -0,0 +1,284 @@
+'''
+Response pipeline graph
+
+Everything after T2T in a response (text filters, TTS and audio filters) runs
+as a graph of stages. Each stage uses a loaded operation, runs in its own
+task(s) and hands results to the next stage(s) through bounded queues. A
+full queue makes the stage before it wait (backpressure).
+
+Items flowing through the graph are tuples of (kind, chunk) where kind is
+"text" or "audio". A stage only works on the kind its role takes and passes
+everything else through untouched. TTS passes the text along before the
+audio it generated for it, so output order matches what was said.
+
+Filter stages add their results to the chunk they got, so keys set by earlier
+stages (like emotion) carry through to the end.
+
+A stage whose results go to several stages fans out through the multiplexor.
+A stage with several inputs takes one result from each and merges them, with
+later inputs overriding earlier ones on conflicting keys. Branches that get
+joined must therefore produce exactly one result per input, so stages that
+may split results (TTS, or filters like chunker_sentence) are rejected on
+them. Which filters split is only known once they are loaded, so this is
+checked against the loaded operations whenever a graph is built.
+
+The graph is configured with response_graph in the config. When empty, a
+linear graph of all text filters, TTS then all audio filters is used.
+'''
+
+import asyncio
+from typing import Dict, List, Any, AsyncGenerator, Tuple
+
+from utils.config import Config
+from utils.helpers.multiplexor import multiplexor
+from utils.operations import OperationManager, OpRoles
+
+from .error import InvalidPipelineGraph
+
+SOURCE_ID = "source"
+
+class _GraphEnd:
+    '''Marks the end of the stream in a stage queue'''
+
+class _GraphError:
+    '''Carries an exception raised in a stage down to the consumer'''
+    def __init__(self, err: BaseException):
+        self.err = err
+
+class GraphNode():
+    ROLES = [OpRoles.FILTER_TEXT, OpRoles.TTS, OpRoles.FILTER_AUDIO]
+
+    def __init__(self, node_d: Dict[str, Any], default_queue_size: int):
+        if not isinstance(node_d, dict): raise InvalidPipelineGraph("stage must be a mapping, got {}".format(node_d))
+        if "id" not in node_d: raise InvalidPipelineGraph("stage is missing an id")
+        self.node_id: str = str(node_d["id"])
+        if self.node_id == SOURCE_ID: raise InvalidPipelineGraph(f"stage id {SOURCE_ID} is reserved")
+
+        try:
+            self.role: OpRoles = OpRoles(node_d.get("role", None))
+        except ValueError:
+            raise InvalidPipelineGraph(f"stage {self.node_id} has unknown role {node_d.get('role', None)}")
+        if self.role not in self.ROLES:
+            raise InvalidPipelineGraph(f"stage {self.node_id} can not use role {self.role.value}")
+
+        self.op_id: str = node_d.get("op_id", None)
+        inputs = node_d.get("inputs", None) or [SOURCE_ID]
+        if not isinstance(inputs, list): raise InvalidPipelineGraph(f"stage {self.node_id} inputs must be a list of stage ids")
+        self.inputs: List[str] = [str(input_id) for input_id in inputs]
+        try:
+            self.concurrency: int = int(node_d.get("concurrency", 1))
+            self.queue_size: int = int(node_d.get("queue_size", default_queue_size))
+        except (TypeError, ValueError):
+            raise InvalidPipelineGraph(f"stage {self.node_id} concurrency and queue_size must be numbers")
+
+        if self.concurrency < 1: raise InvalidPipelineGraph(f"stage {self.node_id} concurrency must be at least 1")
+        if self.queue_size < 1: raise InvalidPipelineGraph(f"stage {self.node_id} queue_size must be at least 1")
+        if len(set(self.inputs)) != len(self.inputs): raise InvalidPipelineGraph(f"stage {self.node_id} has duplicate inputs")
+
+    async def apply(self, item: Tuple[str, Dict[str, Any]], include_audio: bool) -> AsyncGenerator[Tuple[str, Dict[str, Any]], None]:
+        kind, chunk_in = item
+        match self.role:
+            case OpRoles.FILTER_TEXT:
+                if kind != "text":
+                    yield item
+                    return
+                async for chunk_out in OperationManager().use_operation(OpRoles.FILTER_TEXT, chunk_in, op_id=self.op_id):
+                    yield "text", chunk_in | chunk_out
+            case OpRoles.TTS:
+                yield item
+                if kind != "text" or not include_audio: return
+                async for chunk_out in OperationManager().use_operation(OpRoles.TTS, chunk_in, op_id=self.op_id):
+                    yield "audio", chunk_out
+            case OpRoles.FILTER_AUDIO:
+                if kind != "audio":
+                    yield item
+                    return
+                async for chunk_out in OperationManager().use_operation(OpRoles.FILTER_AUDIO, chunk_in, op_id=self.op_id):
+                    yield "audio", chunk_in | chunk_out
+
+    def splits(self) -> bool:
+        '''Whether the stage may yield more than one result per input, judging by the loaded operations'''
+        if self.role == OpRoles.TTS: return True # Passes the text along before its audio
+        filters = OperationManager().get_operation(self.role) or list()
+        return any(op.SPLITS and not op.is_noop() for op in filters if self.op_id is None or op.op_id == self.op_id)
+
+class PipelineGraph():
+    def __init__(self, graph_l: List[Dict[str, Any]] = None, default_queue_size: int = None):
+        if default_queue_size is None: default_queue_size = max(Config().response_lookahead, 1)
+        if not graph_l: graph_l = self.default_graph()
+
+        self.nodes: Dict[str, GraphNode] = dict()
+        for node_d in graph_l:
+            node = GraphNode(node_d, default_queue_size)
+            if node.node_id in self.nodes: raise InvalidPipelineGraph(f"duplicate stage id {node.node_id}")
+            self.nodes[node.node_id] = node
+
+        self.children: Dict[str, List[str]] = {SOURCE_ID: list()} | {node_id: list() for node_id in self.nodes}
+        for node in self.nodes.values():
+            for input_id in node.inputs:
+                if input_id not in self.children: raise InvalidPipelineGraph(f"stage {node.node_id} has unknown input {input_id}")
+                self.children[input_id].append(node.node_id)
+
+        self.order: List[str] = self._sort()
+        sinks = [node_id for node_id in self.nodes if len(self.children[node_id]) == 0]
+        if len(sinks) != 1: raise InvalidPipelineGraph(f"graph must end in exactly one stage, found {sinks}")
+        self.sink_id: str = sinks[0]
+        if OperationManager.instance is not None: self.check_joins()
+
+    @staticmethod
+    def default_graph() -> List[Dict[str, Any]]:
+        '''Linear graph applying all text filters, then TTS, then all audio filters'''
+        return [
+            {"id": "filter_text", "role": OpRoles.FILTER_TEXT.value},
+            {"id": "tts", "role": OpRoles.TTS.value, "inputs": ["filter_text"]},
+            {"id": "filter_audio", "role": OpRoles.FILTER_AUDIO.value, "inputs": ["tts"]}
+        ]
+
+    def check_joins(self) -> None:
+        '''Reject stages that may split results on branches that get joined'''
+        for node in self.nodes.values():
+            if len(node.inputs) < 2: continue
+            branches = [self._ancestors(input_id) for input_id in node.inputs]
+            # Stages before the fan out feed every branch alike, only the branches themselves must not split
+            for node_id in set.union(*branches) - set.intersection(*branches):
+                if self.nodes[node_id].splits():
+                    raise InvalidPipelineGraph(f"stage {node_id} may yield several results per input but is on a branch joined by stage {node.node_id}")
+
+    def _ancestors(self, node_id: str) -> set:
+        '''The stage and every stage before it'''
+        ancestors = set()
+        pending = [node_id]
+        while pending:
+            current = pending.pop()
+            if current == SOURCE_ID or current in ancestors: continue
+            ancestors.add(current)
+            pending.extend(self.nodes[current].inputs)
+        return ancestors
+
+    def _sort(self) -> List[str]:
+        '''Topologically sort stages, rejecting cycles'''
+        in_degree = {node_id: len(node.inputs) for node_id, node in self.nodes.items()}
+        ready = [SOURCE_ID]
+        order = list()
+        while ready:
+            node_id = ready.pop(0)
+            if node_id != SOURCE_ID: order.append(node_id)
+            for child_id in self.children[node_id]:
+                in_degree[child_id] -= 1
+                if in_degree[child_id] == 0: ready.append(child_id)
+
+        if len(order) != len(self.nodes):
+            raise InvalidPipelineGraph("graph contains a cycle")
+        return order
+
+    async def run(self, source: AsyncGenerator[str, None], include_audio: bool = True) -> AsyncGenerator[Tuple[str, Dict[str, Any]], None]:
+        '''Feed each text from source through the graph, yielding results of the final stage in order'''
+        tasks: List[asyncio.Task] = list()
+        branches: Dict[Tuple[str, str], AsyncGenerator] = dict() # (parent, child) to stream
+
+        def add_output(node_id: str, stream: AsyncGenerator, queue_size: int):
+            children = self.children[node_id]
+            if len(children) == 1:
+                branches[(node_id, children[0])] = stream
+            elif len(children) > 1:
+                branch_d, fan_out_task = multiplexor({child_id: (lambda s: s) for child_id in children}, stream, maxsize=queue_size)
+                tasks.append(fan_out_task)
+                for child_id in children:
+                    branches[(node_id, child_id)] = branch_d[child_id]
+
+        async def text_source():
+            async for content in source:
+                yield "text", {"content": content}
+
+        try:
+            add_output(SOURCE_ID, text_source(), max(Config().response_lookahead, 1))
+
+            sink_queue = None
+            for node_id in self.order:
+                node = self.nodes[node_id]
+                in_streams = [branches[(input_id, node_id)] for input_id in node.inputs]
+                in_stream = in_streams[0] if len(in_streams) == 1 else self._join(node, in_streams)
+
+                out_queue = asyncio.Queue(maxsize=node.queue_size)
+                tasks.append(asyncio.create_task(self._run_node(node, in_stream, out_queue, include_audio)))
+                if node_id == self.sink_id: sink_queue = out_queue
+                else: add_output(node_id, self._queue_to_stream(out_queue), node.queue_size)
+
+            async for item in self._queue_to_stream(sink_queue):
+                yield item
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _run_node(self, node: GraphNode, in_stream: AsyncGenerator, out_queue: asyncio.Queue, include_audio: bool):
+        try:
+            if node.concurrency == 1:
+                async for item in in_stream:
+                    async for item_out in node.apply(item, include_audio):
+                        await out_queue.put(item_out)
+            else:
+                await self._run_node_concurrent(node, in_stream, out_queue, include_audio)
+        except Exception as err:
+            await out_queue.put(_GraphError(err))
+            return
+
+        await out_queue.put(_GraphEnd())
+
+    async def _run_node_concurrent(self, node: GraphNode, in_stream: AsyncGenerator, out_queue: asyncio.Queue, include_audio: bool):
+        '''Process up to node.concurrency items at once, forwarding results in input order'''
+        semaphore = asyncio.Semaphore(node.concurrency)
+        pending = asyncio.Queue(maxsize=node.queue_size)
+
+        async def collect(item):
+            async with semaphore:
+                return [item_out async for item_out in node.apply(item, include_audio)]
+
+        async def dispatch():
+            try:
+                async for item in in_stream:
+                    await pending.put(asyncio.create_task(collect(item)))
+            except Exception as err:
+                await pending.put(_GraphError(err))
+                return
+            await pending.put(_GraphEnd())
+
+        dispatcher = asyncio.create_task(dispatch())
+        try:
+            while True:
+                entry = await pending.get()
+                if isinstance(entry, _GraphEnd): break
+                if isinstance(entry, _GraphError): raise entry.err
+                for item_out in await entry:
+                    await out_queue.put(item_out)
+        finally:
+            dispatcher.cancel()
+            while not pending.empty():
+                entry = pending.get_nowait()
+                if isinstance(entry, asyncio.Task): entry.cancel()
+
+    async def _join(self, node: GraphNode, in_streams: List[AsyncGenerator]) -> AsyncGenerator[Tuple[str, Dict[str, Any]], None]:
+        '''Take one result from each input and merge them into one'''
+        iterators = [stream.__aiter__() for stream in in_streams]
+        while True:
+            items = list()
+            for iterator in iterators:
+                try:
+                    items.append(await iterator.__anext__())
+                except StopAsyncIteration:
+                    items.append(None)
+
+            if all(item is None for item in items): return
+            if any(item is None for item in items) or len(set(kind for kind, _ in items)) > 1:
+                raise InvalidPipelineGraph(f"inputs of stage {node.node_id} did not produce matching results")
+
+            merged = dict()
+            for _, chunk in items:
+                merged |= chunk
+            yield items[0][0], merged
+
+    async def _queue_to_stream(self, queue: asyncio.Queue) -> AsyncGenerator[Tuple[str, Dict[str, Any]], None]:
+        while True:
+            item = await queue.get()
+            if isinstance(item, _GraphEnd): break
+            if isinstance(item, _GraphError): raise item.err
+            yield item
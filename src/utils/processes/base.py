@@ -54,6 +54,6 @@ class BaseProcess(): # Be sure to make it a singleton (metaclass=Singleton)
             raise MissingLink(link_id, self.id)
         self.links.remove(link_id)
         
-        if len(self.links):
+        if not len(self.links):
             logging.info(f"No more links to process {self.id}. Unloading...")
             await self.unload()
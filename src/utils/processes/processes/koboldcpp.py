@@ -2,6 +2,7 @@ import logging
 import subprocess
 from subprocess import DEVNULL
 import socket
+import httpx
 from utils.config import Config
 from utils.helpers.singleton import Singleton
 from ..base import BaseProcess
@@ -10,6 +11,7 @@ class KoboldCPPProcess(BaseProcess, metaclass=Singleton):
     def __init__(self):
         super().__init__("koboldcpp")
         self.reload_signal = True
+        self.client: httpx.AsyncClient = None # Keep-alive connections shared by all Kobold operations
         
     async def reload(self):
         # Close any existing servers
@@ -29,4 +31,16 @@ class KoboldCPPProcess(BaseProcess, metaclass=Singleton):
         cmd = '{} --quiet --config "{}" --port {}'.format(config.kobold_filepath, config.kcpps_filepath, self.port)
         logging.debug(f"Running Koboldcpp server using command: \"{cmd}\"")
         self.process = subprocess.Popen(cmd, shell=True, stdout=DEVNULL, stderr=DEVNULL)
-        logging.info(f"Opened Koboldcpp server (PID: {self.process.pid}) on port {self.port}")
\ No newline at end of file
+        logging.info(f"Opened Koboldcpp server (PID: {self.process.pid}) on port {self.port}")
+        
+        self.client = httpx.AsyncClient(
+            base_url="http://127.0.0.1:{}".format(self.port),
+            timeout=httpx.Timeout(None, connect=10.0), # Generation can take arbitrarily long
+            limits=httpx.Limits(max_connections=8, max_keepalive_connections=8)
+        )
+        
+    async def unload(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+        await super().unload()
\ No newline at end of file
@@ -1,7 +1,7 @@
 
 import os
 import datetime
-from typing import AsyncGenerator, Dict, List, Any
+from typing import AsyncGenerator, Dict, List, Any, Tuple
 from utils.helpers.time import get_current_time
 from utils.helpers.singleton import Singleton
 from utils.helpers.path import portable_path
@@ -68,12 +68,16 @@ class Prompter(metaclass=Singleton):
         self.history = list()
         
     def insert_history(self, message: Message):
-        self.history.append(message)
+        self.insert_history_batch([message])
+        
+    def insert_history_batch(self, messages: List[Message]):
+        self.history.extend(messages)
         self.history = self.history[-(self.history_length):]
         
         with open(Config().history_filepath, 'a', encoding="utf-8") as f:
-            f.write(message.to_line())
-            f.write("\n")
+            for message in messages:
+                f.write(message.to_line())
+                f.write("\n")
     
     # Custom context
     def register_custom_context(self, context_id: str, context_name: str, context_description: str = None):
@@ -103,6 +107,19 @@ class Prompter(metaclass=Singleton):
         if time is None: time = get_current_time(include_ms=False, as_str=False)
         self.insert_history(ChatMessage(self.translate_name(name), message, time))
         
+    def add_chats(self, chats: List[Tuple[str, str, datetime.datetime]]) -> List[ChatMessage]:
+        '''Add several (name, message, time) chat lines at once, returning the lines added'''
+        messages = list()
+        for name, message, time in chats:
+            assert name and len(name) > 0
+            assert message and len(message) > 0
+            
+            if time is None: time = get_current_time(include_ms=False, as_str=False)
+            messages.append(ChatMessage(self.translate_name(name), message, time))
+            
+        self.insert_history_batch(messages)
+        return messages
+        
     async def add_chat_stream(self, name: str, in_stream: AsyncGenerator, time: datetime.datetime = None):
         if time is None: time = get_current_time(include_ms=False, as_str=False)
         
@@ -0,0 +1,101 @@
+'''
+Resource-aware job scheduling
+
+Every job claims the resources it uses (prompter history, prompter setup,
+config, loaded operations of a role, the response output) with an access mode. A job starts as soon
+as its claims don't conflict with any job submitted before it that hasn't
+finished yet, whether that job is running or still waiting. Jobs that don't
+share anything run side by side, while conflicting jobs keep the order they
+were requested in.
+
+Access modes:
+- READ: uses the resource without changing it. Compatible with other readers
+- APPEND: adds to the resource (history lines). Compatible with other appenders,
+  but not with readers who need a stable snapshot
+- WRITE: changes the resource. Conflicts with everything
+
+A running job may downgrade a claim once it no longer needs it as strongly,
+for example a response goes from reading history to appending to it once it
+took its prompt snapshot, letting new chat messages be added while it speaks.
+'''
+
+import asyncio
+from enum import Enum
+from collections import OrderedDict
+from typing import Dict, List, Set
+
+class Access(Enum):
+    READ = "read"
+    APPEND = "append"
+    WRITE = "write"
+
+class Resource():
+    HISTORY = "history"
+    PROMPTER = "prompter"
+    CONFIG = "config"
+    RESPONSE = "response" # Broadcast output of responses, so only one speaks at a time
+
+    @staticmethod
+    def op(role: str) -> str:
+        return "op:{}".format(role)
+
+_COMPATIBLE = {(Access.READ, Access.READ), (Access.APPEND, Access.APPEND)}
+
+def conflicts(claims_a: Dict[str, Access], claims_b: Dict[str, Access]) -> bool:
+    for resource, access in claims_a.items():
+        if resource in claims_b and (access, claims_b[resource]) not in _COMPATIBLE:
+            return True
+    return False
+
+class JobScheduler():
+    def __init__(self, max_running: int = 1):
+        self.max_running = max(max_running, 1)
+        self.jobs: OrderedDict[str, Dict[str, Access]] = OrderedDict() # Unfinished jobs in the order they were submitted
+        self.running: Set[str] = set()
+        self.changed = asyncio.Event()
+
+    def submit(self, job_id: str, claims: Dict[str, Access]) -> None:
+        self.jobs[job_id] = dict(claims)
+        self.changed.set()
+
+    def downgrade(self, job_id: str, resource: str, access: Access) -> None:
+        '''Weaken (or drop with None) a claim of a running job'''
+        if job_id not in self.jobs: return
+        if access is None: self.jobs[job_id].pop(resource, None)
+        else: self.jobs[job_id][resource] = access
+        self.changed.set()
+
+    def finish(self, job_id: str) -> None:
+        self.jobs.pop(job_id, None)
+        self.running.discard(job_id)
+        self.changed.set()
+
+    def take_ready(self) -> List[str]:
+        '''Mark and return waiting jobs that can start now, in submission order'''
+        ready = list()
+        earlier: List[Dict[str, Access]] = list()
+        for job_id, claims in self.jobs.items():
+            if len(self.running) >= self.max_running: break
+            if job_id not in self.running and not any(conflicts(claims, other) for other in earlier):
+                self.running.add(job_id)
+                ready.append(job_id)
+            earlier.append(claims)
+        return ready
+
+    def last_job(self) -> str:
+        '''Most recently submitted job that hasn't finished'''
+        return next(reversed(self.jobs), None)
+
+    def is_waiting(self, job_id: str) -> bool:
+        return job_id in self.jobs and job_id not in self.running
+
+    def waiting_count(self) -> int:
+        return len(self.jobs) - len(self.running)
+
+    async def wait(self, timeout: float = None) -> None:
+        '''Wait until something was submitted, downgraded or finished, or timeout seconds passed'''
+        try:
+            await asyncio.wait_for(self.changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self.changed.clear()
@@ -1,14 +1,25 @@
-from quart import Quart, request, websocket
+from quart import Quart, request, websocket, make_response
 import asyncio
 import json
 import base64
 import logging
+import itertools
+from collections import deque
+from typing import Set, Dict, List, Tuple, FrozenSet, Union, Deque
 from utils.args import args
 from utils.helpers.singleton import Singleton
 from utils.jaison import JAIson, JobType, NonexistantJobException
 from utils.config import Config
+from utils.tracing import Tracer
+from utils.metrics import Metrics
 from utils.helpers.observer import BaseObserverClient
+from utils.helpers.iterable import chunk_buffer
 from .common import create_response, create_preflight
+from .connection import SocketConnection
+from .encoding import encode_message
+from .job_tracker import JobTracker
+from .frames import encode_audio_frame
+from .subscription import Subscription, InvalidSubscription
 
 app = Quart(__name__)
 cors_header = {'Access-Control-Allow-Origin': '*'}
@@ -18,19 +29,115 @@ cors_header = {'Access-Control-Allow-Origin': '*'}
 class SocketServerObserver(BaseObserverClient, metaclass=Singleton):
     def __init__(self):
         super().__init__(server=JAIson().event_server)
-        self.connections = set()
+        self.connections: Set[SocketConnection] = set()
+        self.audio_seq: Dict[str, int] = dict() # Next audio chunk number of each job
+        self.event_seq: int = 0 # Number of the last event broadcast
+        self.replay: Deque[Tuple[int, str, dict, int]] = deque(maxlen=max(Config().ws_replay_size, 0)) # Recent (event_seq, event_id, payload, audio_seq)
         self.shutdown_signal = asyncio.Future()
 
     async def handle_event(self, event_id: str, payload) -> None:
         '''Broadcast events from broadcast server'''
-        for key in payload:
-            if isinstance(payload[key], bytes):
-                  payload[key] = base64.b64encode(payload[key]).decode('utf-8')
-        message = json.dumps(create_response(200, event_id, payload))
-        logging.debug(f"Broadcasting event to {len(self.connections)} clients")
-        for ws in set(self.connections):
-            await ws.send(message)
+        with Tracer().span("websocket.broadcast", job_id=payload.get("job_id", None), event=event_id, clients=len(self.connections)) as span_attrs:
+            job_id = payload.get("job_id", None)
+            result = payload.get("result", None)
+            audio_seq = None
+            if isinstance(result, dict) and isinstance(result.get("audio_bytes", None), bytes):
+                audio_seq = self.audio_seq.get(job_id, 0)
+                self.audio_seq[job_id] = audio_seq + 1
+            if payload.get("finished", False): self.audio_seq.pop(job_id, None)
             
+            self.event_seq += 1
+            payload = payload | {"event_seq": self.event_seq}
+            self.replay.append((self.event_seq, event_id, payload, audio_seq))
+
+            # Only queued here, each connection sends at its own pace
+            # Encoded once per distinct subscription fields and audio format, and only if someone gets it
+            encoded: Dict[Tuple[FrozenSet[str], bool], List[Union[str, bytes]]] = dict()
+            dropped, skipped = 0, 0
+            for connection in set(self.connections):
+                sent = self._deliver(connection, event_id, payload, audio_seq, encoded)
+                if sent is None: skipped += 1
+                elif not sent: dropped += 1
+            span_attrs["bytes"] = sum(len(message) for messages in encoded.values() for message in messages)
+            span_attrs["dropped"] = dropped
+            span_attrs["skipped"] = skipped
+            logging.debug("Broadcasting event to %d clients", len(self.connections)-skipped)
+
+    def _deliver(self, connection: SocketConnection, event_id: str, payload: dict, audio_seq: int, encoded: dict, force: bool = False) -> bool:
+        '''Queue an event for a connection. Returns None if its subscription skips it, False if it was dropped'''
+        subscription = connection.subscription
+        if not subscription.matches(event_id, payload): return None
+        
+        key = (subscription.fields, connection.binary_audio)
+        if key not in encoded:
+            projected = subscription.project(payload)
+            encoded[key] = self._encode(event_id, projected, audio_seq, connection.binary_audio) if projected is not None else list()
+        if not encoded[key]: return None
+        
+        # Audio and job completions go out right away, other events may be batched. Completions are never dropped
+        finished = payload.get("finished", False)
+        batchable = audio_seq is None and not finished
+        # Pieces of one event are queued together, so they're dropped or sent as a whole
+        messages = encoded[key] if len(encoded[key]) > 1 else encoded[key][0]
+        return connection.send(messages, is_audio=(audio_seq is not None), force=force, batchable=batchable, droppable=not finished)
+
+    def _encode(self, event_id: str, payload: dict, seq: int, binary_audio: bool) -> List[Union[str, bytes]]:
+        '''Messages to send for an event. Audio becomes a binary frame or JSON events with base64 pieces'''
+        result = payload.get("result", None)
+        if seq is None or not isinstance(result, dict) or not isinstance(result.get("audio_bytes", None), bytes):
+            return [encode_message(200, event_id, payload)]
+        
+        audio_bytes = result["audio_bytes"]
+        if binary_audio:
+            return [encode_audio_frame(payload.get("job_id", None), seq, result.get("sr", 0), result.get("sw", 0), result.get("ch", 0), audio_bytes, result.get("codec", "pcm"))]
+        
+        messages = list()
+        for piece in chunk_buffer(base64.b64encode(audio_bytes).decode('utf-8')):
+            piece_payload = payload | {"result": result | {"audio_bytes": piece, "seq": seq}}
+            messages.append(encode_message(200, event_id, piece_payload))
+        return messages
+
+    async def handle_message(self, connection: SocketConnection, data: Union[str, bytes]) -> None:
+        '''Handle a message sent by a websocket client'''
+        try:
+            message = json.loads(data)
+            if not isinstance(message, dict): raise InvalidSubscription("Message must be a JSON object")
+            
+            match message.get("type", None):
+                case "subscribe":
+                    connection.subscription = Subscription.from_message(message)
+                    if "audio" in message: connection.binary_audio = (message["audio"] == "binary")
+                    if "batch" in message: connection.batch = bool(message["batch"])
+                    reply = connection.subscription.to_dict() | {"audio": "binary" if connection.binary_audio else "json", "batch": connection.batch}
+                    connection.send(encode_message(200, "subscribed", reply), droppable=False)
+                case "resume":
+                    after = message.get("after", None)
+                    if not isinstance(after, int) or isinstance(after, bool): raise InvalidSubscription("after must be the event_seq of the last event received")
+                    job_ids = message.get("job_ids", None)
+                    if job_ids is not None and not isinstance(job_ids, list): raise InvalidSubscription("job_ids must be a list of strings")
+                    self._replay(connection, after, set(job_ids) if job_ids is not None else None)
+                case _:
+                    raise InvalidSubscription("Unknown message type {}".format(message.get("type", None)))
+        except (ValueError, InvalidSubscription) as err:
+            connection.send(encode_message(400, "invalid_message", {"reason": str(err)}), droppable=False)
+            
+    def _replay(self, connection: SocketConnection, after: int, job_ids: Set[str] = None) -> None:
+        '''Send a reconnected client the events it missed after event_seq after, as long as they are still kept'''
+        # Events from live_from on were already offered to the connection live, sending them again would repeat them out of order
+        live_from = connection.live_from if connection.live_from is not None else self.event_seq + 1
+        missed = list(itertools.takewhile(lambda entry: entry[0] > after, reversed(self.replay)))
+        missed.reverse()
+        missed = [entry for entry in missed if entry[0] < live_from]
+        
+        replayed = 0
+        for event_seq, event_id, payload, audio_seq in missed:
+            if job_ids is not None and payload.get("job_id", None) not in job_ids: continue
+            if self._deliver(connection, event_id, payload, audio_seq, dict(), force=True): replayed += 1
+        
+        # Incomplete if events after the requested one were already pushed out of the buffer
+        complete = after >= self.event_seq or (len(self.replay) > 0 and self.replay[0][0] <= after + 1)
+        connection.send(encode_message(200, "resumed", {"after": after, "replayed": replayed, "complete": complete, "event_seq": self.event_seq, "live_from": live_from}), force=True)
+
     def shutdown(self, *args): # TODO set for use somewhere
         self.shutdown_signal.set_result(None)
         
@@ -40,14 +147,44 @@ async def ws():
     logging.info("Opened new websocket connection")
     ws = websocket._get_current_object()
     await ws.accept()
-    sso.connections.add(ws)
+    connection = SocketConnection(
+        ws,
+        binary_audio=(websocket.args.get("audio", None) == "binary"),
+        batch=(websocket.args.get("batch", None) in ("1", "true"))
+    )
+    connection.start()
+    # Missed events are replayed before joining the broadcast, so nothing live can get ahead of them
+    connection.live_from = sso.event_seq + 1
+    after = websocket.args.get("after", None)
+    if after is not None:
+        try:
+            sso._replay(connection, int(after))
+        except ValueError:
+            connection.send(encode_message(400, "invalid_message", {"reason": "after must be the event_seq of the last event received"}), droppable=False)
+    sso.connections.add(connection)
+    Metrics().ws_connections.set(len(sso.connections))
+    closed = asyncio.ensure_future(connection.wait_closed())
+    receiver = asyncio.ensure_future(_receive_loop(sso, connection, ws))
     try:
-        while not sso.shutdown_signal.done():
-            await asyncio.sleep(10)
-    except asyncio.CancelledError:
-        sso.connections.discard(ws)
+        # Returning closes the websocket, when the client leaves, falls too far behind or on shutdown
+        await asyncio.wait([closed, receiver, sso.shutdown_signal], return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        closed.cancel()
+        receiver.cancel()
+        sso.connections.discard(connection)
+        Metrics().ws_connections.set(len(sso.connections))
+        await connection.close()
         logging.info("Closed websocket connection")
+
+async def _receive_loop(sso: SocketServerObserver, connection: SocketConnection, ws):
+    try:
+        while True:
+            data = await ws.receive()
+            await sso.handle_message(connection, data)
+    except asyncio.CancelledError:
         raise
+    except Exception as err:
+        logging.info("Stopped receiving from websocket client: {}".format(err))
 
 ## Generic endpoints ###################
 
@@ -55,6 +192,14 @@ async def ws():
 async def get_loaded_operations():
     return create_response(200, f"Loaded operations gotten", JAIson().get_loaded_operations(), cors_header)
   
+@app.route('/api/operations/stats', methods=['GET'])
+async def get_operation_stats():
+    return create_response(200, f"Operation stats gotten", JAIson().get_operation_stats(), cors_header)
+  
+@app.route('/api/metrics', methods=['GET'])
+async def get_metrics():
+    return JAIson().get_metrics(), 200, cors_header | {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+  
 @app.route('/api/config', methods=['GET'])
 async def get_current_config():
     return create_response(200, f"Current config gotten", JAIson().get_current_config(), cors_header)
@@ -73,6 +218,51 @@ async def cancel_job():
     except Exception as err:
         return create_response(500, str(err), {}, cors_header)
 
+@app.route('/api/job/<job_id>', methods=['GET'])
+async def get_job(job_id: str):
+    try:
+        wait = min(float(request.args.get('wait', 0)), Config().job_result_max_wait)
+    except ValueError:
+        return create_response(400, f"wait must be a number of seconds", {}, cors_header)
+    
+    status = await JobTracker().wait(job_id, wait)
+    if status is None: return create_response(404, f"Job ID does not exist or is no longer remembered", {}, cors_header)
+    return create_response(200, f"Job status gotten", status, cors_header)
+
+def _sse_frame(event_id: str, payload: dict) -> str:
+    return "event: {}\ndata: {}\n\n".format(event_id, encode_message(200, event_id, payload))
+
+@app.route('/api/job/<job_id>/events', methods=['GET'])
+async def get_job_events(job_id: str):
+    tracker = JobTracker()
+    record = tracker.get_record(job_id)
+    if record is None and not JAIson().has_job(job_id):
+        return create_response(404, f"Job ID does not exist or is no longer remembered", {}, cors_header)
+    
+    async def stream():
+        record = tracker.get_record(job_id) # Again, it may have finished before streaming began
+        if record is not None and record.done.is_set():
+            # Too late for its events, only the summary is left
+            yield _sse_frame("job_result", record.to_dict())
+            return
+        
+        queue = tracker.listen(job_id)
+        try:
+            while True:
+                try:
+                    event_id, payload = await asyncio.wait_for(queue.get(), Config().job_events_keepalive)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield _sse_frame(event_id, payload)
+                if payload.get("finished", False): break
+        finally:
+            tracker.unlisten(job_id, queue)
+    
+    response = await make_response(stream(), 200, cors_header | {'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    response.timeout = None
+    return response
+
 ## Specific job creation endpoints ####
 
 async def _request_job(job_type: JobType):
@@ -85,6 +275,25 @@ async def _request_job(job_type: JobType):
         logging.error(f"Error occured for {job_type} API request", stack_info=True, exc_info=True)
         return create_response(500, str(err), {}, cors_header)
 
+@app.route('/api/jobs/batch', methods=['POST'])
+async def jobs_batch():
+    try:
+        request_data = (await request.get_json()) or dict()
+        jobs = request_data.get('jobs', None)
+        assert isinstance(jobs, list) and len(jobs) > 0 and all(isinstance(job, dict) and 'type' in job for job in jobs)
+        if len(jobs) > Config().job_batch_max:
+            return create_response(400, f"Too many jobs in batch (max {Config().job_batch_max})", {}, cors_header)
+        
+        job_ids = await JAIson().create_jobs([(job['type'], {key: value for key, value in job.items() if key != 'type'}) for job in jobs])
+        return create_response(200, f"{len(job_ids)} jobs created", {"job_ids": job_ids}, cors_header)
+    except AssertionError as err:
+        return create_response(400, f"Request needs jobs, a list of objects each with a type", {}, cors_header)
+    except (ValueError, TypeError) as err:
+        return create_response(400, f"Invalid job in batch, none were created: {err}", {}, cors_header)
+    except Exception as err:
+        logging.error(f"Error occured for batch job API request", stack_info=True, exc_info=True)
+        return create_response(500, str(err), {}, cors_header)
+
 # Main response pipeline
 @app.route('/api/response', methods=['POST'])
 async def response():
@@ -167,6 +376,18 @@ async def config_save():
 async def preflight_job():
     return create_preflight('DELETE')
 
+@app.route('/api/job/<job_id>', methods=['OPTIONS']) 
+async def preflight_job_status(job_id: str):
+    return create_preflight('GET')
+
+@app.route('/api/job/<job_id>/events', methods=['OPTIONS']) 
+async def preflight_job_events(job_id: str):
+    return create_preflight('GET')
+
+@app.route('/api/jobs/batch', methods=['OPTIONS']) 
+async def preflight_jobs_batch():
+    return create_preflight('POST')
+
 @app.route('/api/response', methods=['OPTIONS']) 
 async def preflight_response():
     return create_preflight('POST')
@@ -199,6 +420,14 @@ async def preflight_context_custom():
 async def preflight_operations_info():
     return create_preflight('GET')
 
+@app.route('/api/operations/stats', methods=['OPTIONS']) 
+async def preflight_operations_stats():
+    return create_preflight('GET')
+
+@app.route('/api/metrics', methods=['OPTIONS']) 
+async def preflight_metrics():
+    return create_preflight('GET')
+
 @app.route('/api/operations/load', methods=['OPTIONS']) 
 async def preflight_operation_start():
     return create_preflight('POST')
@@ -241,6 +470,7 @@ async def start_web_server(): # TODO launch application plugins here as well
         global app
         await JAIson().start()
         SocketServerObserver()
+        JobTracker()
         await app.run_task(host=args.host, port=args.port)
     except Exception as err:
         logging.error("Stopping server due to exception", exc_info=True)
@@ -0,0 +1,152 @@
+'''
+Websocket client connections
+
+Each connection gets its own bounded send queue and a writer task draining it,
+so one slow client only ever holds up itself. Broadcasting just puts the
+encoded message in every connection's queue without waiting. When a client
+can't keep up and its queue is full, the overflow policy for the kind of event
+decides what gives:
+- drop_oldest: drop the oldest queued event of the same kind to make room. If
+  there is none, the queue is backed up with the other kind: its oldest event
+  is dropped if that kind also drops its oldest, otherwise the new event is
+- drop_newest: drop the new event
+- disconnect: close the connection, the client is expected to reconnect
+An event sent in several messages (audio in base64 pieces) is queued as one
+entry, so it is always dropped or sent whole. Job completions and replies to
+the client are never dropped, they are queued even when the queue is full.
+
+Clients that opt into batching get small text events that are queued within
+ws_batch_window_ms of each other in one frame. Audio, job completions and
+replies to the client are sent right away, taking anything batched with them.
+'''
+
+import asyncio
+import logging
+from enum import Enum
+from collections import deque
+from typing import Deque, Union, Tuple, List
+
+from utils.config import Config
+from utils.metrics import Metrics
+
+from .subscription import Subscription
+from .encoding import encode_batch
+
+class OverflowPolicy(Enum):
+    DROP_OLDEST = "drop_oldest"
+    DROP_NEWEST = "drop_newest"
+    DISCONNECT = "disconnect"
+
+AUDIO = "audio"
+TEXT = "text"
+
+class SocketConnection():
+    MAX_BATCH = 64 # Events per batch frame at most
+
+    def __init__(self, ws, binary_audio: bool = False, batch: bool = False):
+        self.ws = ws
+        self.binary_audio = binary_audio # Audio sent as binary frames (see frames.py) instead of JSON
+        self.batch = batch # Small text events sent together in batch frames
+        self.batch_window = max(Config().ws_batch_window_ms, 0) / 1000
+        self.subscription = Subscription() # Everything until the client subscribes to less
+        self.max_queued = max(Config().ws_send_queue_size, 1)
+        self.text_policy = OverflowPolicy(Config().ws_text_overflow)
+        self.audio_policy = OverflowPolicy(Config().ws_audio_overflow)
+
+        self.queue: Deque[Tuple[Union[str, bytes, List[Union[str, bytes]]], bool, str]] = deque() # (message or messages of one event, batchable, kind), kind None if it can't be dropped
+        self.ready = asyncio.Event() # Set while queue has something to send
+        self.flush = asyncio.Event() # Set while queue has something that shouldn't wait for a batch
+        self.closed = asyncio.Event()
+        self.writer: asyncio.Task = None
+        self.dropped: int = 0
+        self.live_from: int = None # event_seq of the first event broadcast while connected, earlier ones only come from a replay
+
+    def start(self) -> None:
+        self.writer = asyncio.create_task(self._write_loop())
+
+    async def close(self) -> None:
+        self.closed.set()
+        if self.writer is not None:
+            self.writer.cancel()
+            try:
+                await self.writer
+            except asyncio.CancelledError:
+                pass
+
+    def send(self, message: Union[str, bytes, List[Union[str, bytes]]], is_audio: bool = False, force: bool = False, batchable: bool = False, droppable: bool = True) -> bool:
+        '''Queue an event's message (or its list of messages) without waiting. Returns False if it was dropped. Forced messages (replays) and undroppable ones ignore the limit'''
+        if self.closed.is_set(): return False
+
+        kind = (AUDIO if is_audio else TEXT) if droppable else None
+        if len(self.queue) >= self.max_queued and not force and kind is not None and not self._make_room(kind): return False
+
+        batchable = batchable and self.batch and isinstance(message, str)
+        self.queue.append((message, batchable, kind))
+        self.ready.set()
+        if not batchable: self.flush.set()
+        return True
+
+    def _make_room(self, kind: str) -> bool:
+        '''Apply the overflow policy for a message of kind to a full queue. Returns False if the message shouldn't be queued'''
+        policy = self.audio_policy if kind == AUDIO else self.text_policy
+        if policy == OverflowPolicy.DROP_OLDEST:
+            if self._drop_oldest(kind): return True
+            # Nothing of this kind queued, so the other kind is what's backed up. Its events only make room if it drops its oldest too,
+            # a client is never disconnected over an event of a kind that doesn't disconnect
+            other = TEXT if kind == AUDIO else AUDIO
+            if (self.audio_policy if other == AUDIO else self.text_policy) == OverflowPolicy.DROP_OLDEST and self._drop_oldest(other): return True
+            policy = OverflowPolicy.DROP_NEWEST
+
+        if policy == OverflowPolicy.DISCONNECT:
+            logging.warning("Disconnecting websocket client that fell {} events behind".format(len(self.queue)))
+            Metrics().ws_slow_disconnects.inc()
+            self.closed.set()
+            return False
+
+        self.dropped += 1
+        Metrics().ws_events_dropped.inc(kind=kind, policy=policy.value)
+        return False
+
+    def _drop_oldest(self, kind: str) -> bool:
+        '''Drop the oldest queued message of kind, False if there is none'''
+        for i, (_, _, queued_kind) in enumerate(self.queue):
+            if queued_kind == kind:
+                del self.queue[i]
+                self.dropped += 1
+                Metrics().ws_events_dropped.inc(kind=kind, policy=OverflowPolicy.DROP_OLDEST.value)
+                return True
+        return False
+
+    async def wait_closed(self) -> None:
+        await self.closed.wait()
+
+    async def _write_loop(self):
+        try:
+            while not self.closed.is_set():
+                await self.ready.wait()
+                if self.batch and self.batch_window > 0 and not self.flush.is_set():
+                    # Give small events a moment to pile up, unless something has to go out now
+                    try:
+                        await asyncio.wait_for(self.flush.wait(), self.batch_window)
+                    except asyncio.TimeoutError:
+                        pass
+                
+                while self.queue:
+                    batch = list()
+                    while self.queue and self.queue[0][1] and len(batch) < self.MAX_BATCH:
+                        batch.append(self.queue.popleft()[0])
+                    if len(batch) == 1: await self.ws.send(batch[0])
+                    elif batch: await self.ws.send(encode_batch(batch))
+                    else:
+                        messages = self.queue.popleft()[0]
+                        for message in (messages if isinstance(messages, list) else [messages]):
+                            await self.ws.send(message)
+                self.ready.clear()
+                self.flush.clear()
+        except asyncio.CancelledError:
+            raise
+        except Exception as err:
+            logging.info("Stopped sending to websocket client: {}".format(err))
+        finally:
+            self.queue.clear()
+            self.closed.set()
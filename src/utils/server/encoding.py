@@ -0,0 +1,26 @@
+'''
+Websocket message encoding
+
+Messages are serialized with orjson, once per message no matter how many
+clients get it. Bytes anywhere in a payload are turned into base64 strings
+while serializing instead of scanning the payload for them beforehand.
+'''
+
+import base64
+from typing import Any, List
+
+import orjson
+
+from .common import create_response
+
+def _default(obj: Any) -> Any:
+    if isinstance(obj, (bytes, bytearray)): return base64.b64encode(obj).decode('utf-8')
+    raise TypeError("Object of type {} is not JSON serializable".format(type(obj).__name__))
+
+def encode_message(status: int, message: str, response: Any) -> str:
+    '''Websocket text frame with the same layout as create_response'''
+    return orjson.dumps(create_response(status, message, response), default=_default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY).decode('utf-8')
+
+def encode_batch(messages: List[str]) -> str:
+    '''One text frame holding several already encoded messages, without encoding them again'''
+    return encode_message(200, "batch", {"events": [orjson.Fragment(message) for message in messages]})
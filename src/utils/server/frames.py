@@ -0,0 +1,33 @@
+'''
+Binary websocket audio frames
+
+Clients that opt in get audio as binary websocket frames instead of base64
+pieces inside JSON events. Each frame is one audio chunk:
+
+| Bytes | Type | Field |
+| --- | --- | --- |
+| 1 | uint8 | version (1) |
+| 16 | uuid | job_id |
+| 4 | uint32 | seq, per job starting at 0 |
+| 4 | uint32 | sr |
+| 1 | uint8 | sw |
+| 1 | uint8 | ch |
+| 1 | uint8 | codec (0 pcm, 1 flac, 2 opus) |
+| rest | | audio, raw PCM or one complete encoded file |
+
+Integers are little-endian.
+'''
+
+import uuid
+import struct
+
+AUDIO_FRAME_VERSION = 1
+AUDIO_FRAME_HEADER = struct.Struct("<B16sIIBBB")
+AUDIO_FRAME_CODECS = {"pcm": 0, "flac": 1, "opus": 2}
+
+def encode_audio_frame(job_id: str, seq: int, sr: int, sw: int, ch: int, audio_bytes: bytes, codec: str = "pcm") -> bytes:
+    try:
+        job_uuid = uuid.UUID(job_id).bytes
+    except (TypeError, ValueError):
+        job_uuid = bytes(16)
+    return AUDIO_FRAME_HEADER.pack(AUDIO_FRAME_VERSION, job_uuid, seq, sr, sw, ch, AUDIO_FRAME_CODECS[codec]) + audio_bytes
@@ -0,0 +1,161 @@
+'''
+Per-job progress and results for HTTP clients
+
+Follows the event broadcasts of every job, so a single job can be streamed
+over Server-Sent Events or its result fetched (and waited on) over plain HTTP
+without a websocket. Events of running jobs are kept so late SSE listeners
+get them from the start. Once a job finishes, only its summary is kept: start
+arguments, result properties gathered from its events, audio format and size,
+error, and timings. The last job_result_cache_size summaries are kept.
+'''
+
+import time
+import asyncio
+from collections import OrderedDict
+from typing import Dict, Any, List, Set, Tuple
+
+from utils.config import Config
+from utils.helpers.singleton import Singleton
+from utils.helpers.observer import BaseObserverClient
+from utils.jaison import JAIson
+
+# Not gathered into summaries: audio is only counted, tokens are repeated by raw_content, job_id of batch entries is known
+_SKIPPED_FIELDS = {"job_id", "audio_bytes", "seq", "t2t_token", "token_seq", "sr", "sw", "ch", "codec"}
+
+class JobRecord():
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.job_type: str = None
+        self.start_time = time.perf_counter()
+        self.duration_ms: float = None
+        self.start: Dict[str, Any] = None
+        self.results: Dict[str, List[Any]] = dict() # Every value of each result property, in order
+        self.audio: Dict[str, Any] = None
+        self.success: bool = None
+        self.error: Dict[str, Any] = None
+        self.timeline: List[Dict[str, Any]] = list()
+        self.events: List[Tuple[str, Dict[str, Any]]] = list() # Only while running
+        self.started = False # Created early when someone waits on a queued job
+        self.done = asyncio.Event()
+
+    def begin(self, job_type: str) -> None:
+        self.job_type = job_type
+        self.start_time = time.perf_counter()
+        self.started = True
+
+    def add_result(self, result: Dict[str, Any]) -> None:
+        if isinstance(result.get("audio_bytes", None), (bytes, str)):
+            if self.audio is None: self.audio = {"chunks": 0, "bytes": 0}
+            self.audio["chunks"] += 1
+            self.audio["bytes"] += len(result["audio_bytes"])
+            for key in ("sr", "sw", "ch", "codec"):
+                if key in result: self.audio[key] = result[key]
+        for key, value in result.items():
+            if key in _SKIPPED_FIELDS: continue
+            self.results.setdefault(key, list()).append(value)
+
+    def finish(self, payload: Dict[str, Any]) -> None:
+        self.duration_ms = round((time.perf_counter()-self.start_time)*1000, 3)
+        self.success = payload.get("success", False)
+        if not self.success: self.error = payload.get("result", None)
+        self.timeline = payload.get("timeline", list())
+        self.events = list()
+        self.done.set()
+
+    def to_dict(self) -> Dict[str, Any]:
+        if not self.started: status = "queued"
+        elif self.success is None: status = "running"
+        else: status = "succeeded" if self.success else "failed"
+        return {
+            "job_id": self.job_id,
+            "job_type": self.job_type,
+            "status": status,
+            "start": self.start,
+            "result": self.results,
+            "audio": self.audio,
+            "error": self.error,
+            "duration_ms": self.duration_ms,
+            "timeline": self.timeline
+        }
+
+class JobTracker(BaseObserverClient, metaclass=Singleton):
+    def __init__(self):
+        super().__init__(server=JAIson().event_server)
+        self.active: Dict[str, JobRecord] = dict()
+        self.finished: OrderedDict[str, JobRecord] = OrderedDict() # Least recently used first
+        self.listeners: Dict[str, Set[asyncio.Queue]] = dict()
+
+    async def handle_event(self, event_id: str, payload) -> None:
+        job_id = payload.get("job_id", None)
+        if job_id is None: return
+
+        record = self._get_or_create(job_id)
+        if not record.started: record.begin(event_id)
+        record.events.append((event_id, payload))
+
+        if "start" in payload: record.start = payload["start"]
+        result = payload.get("result", None)
+        if not payload.get("finished", False) and isinstance(result, dict):
+            # Batched jobs are reported in the first job's events
+            for entry in result.get("batch", list()):
+                if not isinstance(entry, dict) or entry.get("job_id", None) in (None, job_id): continue
+                member = self._get_or_create(entry["job_id"])
+                if not member.started: member.begin(event_id)
+                member.add_result(entry)
+            record.add_result(result)
+
+        for queue in self.listeners.get(job_id, set()):
+            queue.put_nowait((event_id, payload))
+
+        if payload.get("finished", False):
+            record.finish(payload)
+            del self.active[job_id]
+            self._remember(record)
+
+    def _get_or_create(self, job_id: str) -> JobRecord:
+        if job_id not in self.active: self.active[job_id] = JobRecord(job_id)
+        return self.active[job_id]
+
+    def _remember(self, record: JobRecord) -> None:
+        self.finished[record.job_id] = record
+        while len(self.finished) > max(Config().job_result_cache_size, 0):
+            self.finished.popitem(last=False)
+
+    def get_record(self, job_id: str) -> JobRecord:
+        '''Record of a running or recently finished job, None otherwise'''
+        if job_id in self.finished:
+            self.finished.move_to_end(job_id)
+            return self.finished[job_id]
+        return self.active.get(job_id, None)
+
+    def get_status(self, job_id: str) -> Dict[str, Any]:
+        '''Summary of a job, None if it doesn't exist or is no longer remembered'''
+        record = self.get_record(job_id)
+        if record is not None: return record.to_dict()
+        if JAIson().has_job(job_id): return JobRecord(job_id).to_dict()
+        return None
+
+    async def wait(self, job_id: str, timeout: float) -> Dict[str, Any]:
+        '''Summary of a job once it finishes or timeout seconds passed'''
+        record = self.get_record(job_id)
+        if record is None and JAIson().has_job(job_id): record = self._get_or_create(job_id) # Still queued
+        if record is not None and timeout > 0:
+            try:
+                await asyncio.wait_for(record.done.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.get_status(job_id)
+
+    def listen(self, job_id: str) -> asyncio.Queue:
+        '''Queue getting (event_id, payload) of a job, starting with those already broadcast if it is running'''
+        queue = asyncio.Queue()
+        record = self.active.get(job_id, None)
+        if record is not None:
+            for event in record.events: queue.put_nowait(event)
+        self.listeners.setdefault(job_id, set()).add(queue)
+        return queue
+
+    def unlisten(self, job_id: str, queue: asyncio.Queue) -> None:
+        queues = self.listeners.get(job_id, set())
+        queues.discard(queue)
+        if not queues: self.listeners.pop(job_id, None)
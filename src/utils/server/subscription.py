@@ -0,0 +1,58 @@
+'''
+Websocket subscriptions
+
+A client can narrow down what it is sent by sending a subscribe message. Until
+it does, it gets everything. Each subscribe message replaces the previous one.
+- events: job types to get events of, all if not given
+- job_ids: jobs to get events of, all if not given
+- fields: result properties wanted (content, audio_bytes...), all if not given.
+  Job-specific events without any of them are skipped, others are cut down to
+  them. Start and finish events are always sent for matching jobs
+'''
+
+from typing import Dict, Any, FrozenSet, List
+
+class InvalidSubscription(Exception):
+    pass
+
+def _as_set(message: Dict[str, Any], key: str) -> FrozenSet[str]:
+    value = message.get(key, None)
+    if value is None: return None
+    if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+        raise InvalidSubscription("{} must be a list of strings".format(key))
+    return frozenset(value)
+
+class Subscription():
+    def __init__(self, events: List[str] = None, job_ids: List[str] = None, fields: List[str] = None):
+        self.events: FrozenSet[str] = frozenset(events) if events is not None else None
+        self.job_ids: FrozenSet[str] = frozenset(job_ids) if job_ids is not None else None
+        self.fields: FrozenSet[str] = frozenset(fields) if fields is not None else None
+
+    @staticmethod
+    def from_message(message: Dict[str, Any]) -> 'Subscription':
+        subscription = Subscription()
+        subscription.events = _as_set(message, "events")
+        subscription.job_ids = _as_set(message, "job_ids")
+        subscription.fields = _as_set(message, "fields")
+        return subscription
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "events": sorted(self.events) if self.events is not None else None,
+            "job_ids": sorted(self.job_ids) if self.job_ids is not None else None,
+            "fields": sorted(self.fields) if self.fields is not None else None
+        }
+
+    def matches(self, event_id: str, payload: Dict[str, Any]) -> bool:
+        if self.events is not None and event_id not in self.events: return False
+        if self.job_ids is not None and payload.get("job_id", None) not in self.job_ids: return False
+        return True
+
+    def project(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        '''payload cut down to the wanted fields, None if nothing wanted is in it'''
+        result = payload.get("result", None)
+        if self.fields is None or payload.get("finished", False) or not isinstance(result, dict): return payload
+
+        wanted = {key: value for key, value in result.items() if key in self.fields}
+        if not wanted: return None
+        return payload | {"result": wanted}
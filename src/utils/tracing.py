@@ -0,0 +1,193 @@
+'''
+Per-job tracing
+
+Every job gets a trace keyed by its job_id. Stages of the job are recorded as
+spans (name, start relative to the job start, duration, parent span and a few
+attributes). Finished spans are appended to a rotating JSONL file in the log
+directory, one span per line, and the spans of a job so far are included in
+its final websocket event as its timeline.
+
+The root "job" span is closed right before the job's final event is built, so
+the timeline in it covers the whole job. Traces of running jobs are always
+kept. Once a job ends its trace is kept a little longer among the last
+KEEP_TRACES finished ones, so late spans (broadcasts of the final event) can
+still be placed.
+
+The job a piece of code belongs to is tracked with context variables, so
+tasks started from a job (pipeline stages) are traced under it without
+passing anything around. Code running outside the job's task (the websocket
+broadcaster) passes the job_id explicitly.
+'''
+
+import os
+import json
+import time
+import uuid
+import logging
+import logging.handlers
+import contextvars
+from contextlib import contextmanager
+from collections import OrderedDict
+from typing import Dict, Any, List, AsyncGenerator
+
+from utils.args import args
+from utils.config import Config
+from utils.helpers.singleton import Singleton
+
+_current_job: contextvars.ContextVar = contextvars.ContextVar("trace_job_id", default=None)
+_current_span: contextvars.ContextVar = contextvars.ContextVar("trace_span_id", default=None)
+
+class Trace():
+    def __init__(self, job_id: str, job_type: str):
+        self.job_id = job_id
+        self.job_type = job_type
+        self.start_time = time.perf_counter()
+        self.spans: List[Dict[str, Any]] = list()
+        self.root: Dict[str, Any] = None # Root span while it is open
+
+class Tracer(metaclass=Singleton):
+    KEEP_TRACES = 64 # Finished traces kept so late spans (broadcasts) can still be placed
+
+    def __init__(self):
+        self.traces: Dict[str, Trace] = dict() # Jobs that haven't ended
+        self.finished: OrderedDict[str, Trace] = OrderedDict() # Oldest first
+
+        self.file_logger = logging.getLogger("jaison.traces")
+        self.file_logger.propagate = False
+        self.file_logger.setLevel(logging.INFO)
+        if not self.file_logger.handlers:
+            handler = logging.handlers.RotatingFileHandler(
+                os.path.join(args.log_dir, "traces.jsonl"),
+                maxBytes=Config().trace_file_max_bytes,
+                backupCount=Config().trace_file_backups
+            )
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self.file_logger.addHandler(handler)
+
+    def start_trace(self, job_id: str, job_type: str) -> contextvars.Token:
+        '''Start tracing a job in the current context. Tasks created afterwards inherit it'''
+        self.traces[job_id] = Trace(job_id, job_type)
+        return _current_job.set(job_id)
+
+    def end_trace(self, token: contextvars.Token) -> None:
+        _current_job.reset(token)
+
+    def finish_trace(self, job_id: str) -> None:
+        '''Job ended, its trace only has to stay around for late spans now'''
+        trace = self.traces.pop(job_id, None)
+        if trace is None: return
+        self.finished[job_id] = trace
+        while len(self.finished) > self.KEEP_TRACES:
+            self.finished.popitem(last=False)
+
+    def timeline(self, job_id: str = None) -> List[Dict[str, Any]]:
+        '''Spans of a job finished so far, defaulting to the current job'''
+        trace = self._find_trace(job_id or _current_job.get())
+        if trace is None: return list()
+        return [{key: span[key] for key in ("name", "span_id", "parent_id", "start_ms", "duration_ms", "attrs", "error")} for span in trace.spans]
+
+    @contextmanager
+    def span(self, name: str, job_id: str = None, **attrs):
+        '''Record the enclosed block as a span of the current job (or job_id). Does nothing outside jobs'''
+        trace = self._get_trace(job_id)
+        if trace is None:
+            yield attrs
+            return
+
+        span_id = uuid.uuid4().hex[:16]
+        parent_id = _current_span.get()
+        token = _current_span.set(span_id)
+        start_time = time.perf_counter()
+        error = None
+        try:
+            yield attrs # Caller may add attributes while in the span
+        except BaseException as err:
+            error = "{}: {}".format(type(err).__name__, err)
+            raise
+        finally:
+            _current_span.reset(token)
+            self._record(trace, name, span_id, parent_id, start_time, attrs, error)
+
+    @contextmanager
+    def job_span(self, **attrs):
+        '''Record the enclosed block as the root span of the current job. close_job_span may end it early'''
+        trace = self._get_trace()
+        if trace is None:
+            yield attrs
+            return
+
+        span_id = uuid.uuid4().hex[:16]
+        token = _current_span.set(span_id)
+        trace.root = {"span_id": span_id, "start_time": time.perf_counter(), "attrs": attrs}
+        error = None
+        try:
+            yield attrs
+        except BaseException as err:
+            error = "{}: {}".format(type(err).__name__, err)
+            raise
+        finally:
+            _current_span.reset(token)
+            self._close_root(trace, error)
+
+    def close_job_span(self, job_id: str, err: BaseException = None) -> None:
+        '''End the root span of a job before its final event is built so the timeline has its duration'''
+        trace = self._get_trace(job_id)
+        if trace is not None: self._close_root(trace, "{}: {}".format(type(err).__name__, err) if err is not None else None)
+
+    def _close_root(self, trace: Trace, error: str) -> None:
+        root, trace.root = trace.root, None
+        if root is None: return
+        self._record(trace, "job", root["span_id"], None, root["start_time"], root["attrs"], error)
+
+    async def traced(self, name: str, stream: AsyncGenerator, **attrs) -> AsyncGenerator:
+        '''Record consuming stream as a span, including time to its first item'''
+        trace = self._get_trace()
+        if trace is None:
+            async for item in stream:
+                yield item
+            return
+
+        # Generators resume in their consumer's context, so this span isn't made current
+        span_id = uuid.uuid4().hex[:16]
+        parent_id = _current_span.get()
+        start_time = time.perf_counter()
+        error = None
+        attrs["items"] = 0
+        try:
+            async for item in stream:
+                if attrs["items"] == 0: attrs["first_item_ms"] = round((time.perf_counter()-start_time)*1000, 3)
+                attrs["items"] += 1
+                yield item
+        except BaseException as err:
+            error = "{}: {}".format(type(err).__name__, err)
+            raise
+        finally:
+            self._record(trace, name, span_id, parent_id, start_time, attrs, error)
+
+    def _get_trace(self, job_id: str = None) -> Trace:
+        if not Config().tracing: return None
+        return self._find_trace(job_id or _current_job.get())
+
+    def _find_trace(self, job_id: str) -> Trace:
+        if job_id in self.traces: return self.traces[job_id]
+        return self.finished.get(job_id, None)
+
+    def _record(self, trace: Trace, name: str, span_id: str, parent_id: str, start_time: float, attrs: Dict[str, Any], error: str):
+        end_time = time.perf_counter()
+        span = {
+            "job_id": trace.job_id,
+            "job_type": trace.job_type,
+            "name": name,
+            "span_id": span_id,
+            "parent_id": parent_id,
+            "start_ms": round((start_time-trace.start_time)*1000, 3),
+            "duration_ms": round((end_time-start_time)*1000, 3),
+            "attrs": attrs,
+            "error": error
+        }
+        if len(trace.spans) < Config().trace_max_spans: trace.spans.append(span)
+
+        try:
+            self.file_logger.info(json.dumps(span, default=str))
+        except Exception as err:
+            logging.warning("Failed to write trace span: {}".format(err))